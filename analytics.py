@@ -0,0 +1,198 @@
+"""Columnar snapshots of the service history for fast analytics.
+
+build_snapshot() copies visits and items out of the database into a few
+NumPy arrays (one .npy file per column, plus meta.json for the labels).
+Snapshot memory-maps those files and answers the analytics questions with
+vectorized operations (bincount, cumsum), so a query over millions of line
+items takes milliseconds and never touches the live database:
+
+    visits  day (proleptic ordinal), category code, make code, total (cents)
+    items   visit index, part id (-1 without a part), quantity
+
+Snapshots are rebuilt as a whole: a new directory is written next to the old
+one and swapped in with renames, so readers see either the old or the new
+snapshot. NumPy is optional; without it available() is False.
+"""
+import json
+import os
+import shutil
+import time
+from array import array
+from datetime import date, timedelta
+
+from sqlalchemy import Integer, select, type_coerce
+
+try:
+    import numpy as np
+except ImportError:  # analytics is optional
+    np = None
+
+META = 'meta.json'
+VISIT_COLUMNS = {'day': 'i', 'category': 'h', 'make': 'h', 'total': 'q'}
+ITEM_COLUMNS = {'visit': 'i', 'part': 'i', 'quantity': 'i'}
+UNKNOWN = '(none)'
+
+
+def available():
+    return np is not None
+
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError('Analytics requires the numpy package (pip install numpy).')
+
+
+class _Codes(dict):
+    """Dictionary encoding of a text column: label -> small integer code."""
+
+    def code(self, label):
+        label = label or UNKNOWN
+        code = self.get(label)
+        if code is None:
+            code = self[label] = len(self)
+        return code
+
+    def labels(self):
+        return sorted(self, key=self.get)
+
+
+def build_snapshot(engine, tables, directory, batch_size=20000):
+    """Write a snapshot of all visits and items to `directory`; returns its row counts."""
+    _require_numpy()
+    visits, items, vehicles, parts = (tables[name] for name in ('service_visit', 'service_item', 'vehicle', 'part'))
+    columns = {name: array(code) for name, code in {**VISIT_COLUMNS, **ITEM_COLUMNS}.items()}
+    visit_ids = array('q')
+    categories, makes = _Codes(), _Codes()
+    with engine.connect() as conn:
+        # Totals are read as stored integer cents, bypassing the Money type's Decimal conversion
+        query = (select(visits.c.id, visits.c.date, visits.c.visit_category, vehicles.c.name,
+                        type_coerce(visits.c.grand_total, Integer))
+                 .outerjoin(vehicles, vehicles.c.id == visits.c.vehicle_id)
+                 .order_by(visits.c.id))
+        for visit_id, visit_date, category, make, total in conn.execution_options(yield_per=batch_size).execute(query):
+            visit_ids.append(visit_id)
+            columns['day'].append(visit_date.toordinal())
+            columns['category'].append(categories.code(category))
+            columns['make'].append(makes.code(make))
+            columns['total'].append(total or 0)
+
+        item_visit_ids = array('q')
+        query = select(items.c.visit_id, items.c.part_id, items.c.quantity).order_by(items.c.id)
+        for visit_id, part_id, quantity in conn.execution_options(yield_per=batch_size).execute(query):
+            item_visit_ids.append(visit_id)
+            columns['part'].append(-1 if part_id is None else part_id)
+            columns['quantity'].append(quantity or 0)
+
+        part_labels = {part_id: [name, number] for part_id, name, number
+                       in conn.execute(select(parts.c.id, parts.c.name, parts.c.part_number))}
+
+    # Items refer to their visit by position, so per-visit columns can be gathered with one take()
+    visit_ids = np.frombuffer(visit_ids, dtype=np.int64)
+    item_visit_ids = np.frombuffer(item_visit_ids, dtype=np.int64)
+    positions = np.searchsorted(visit_ids, item_visit_ids)
+    # The two reads are separate statements; items of visits committed in between have no visit
+    # in the snapshot and are left out
+    known = positions < len(visit_ids)
+    known[known] = visit_ids[positions[known]] == item_visit_ids[known]
+    columns['visit'] = positions[known].astype(np.int32)
+    for name in ('part', 'quantity'):
+        columns[name] = np.asarray(columns[name])[known]
+    item_visit_ids = item_visit_ids[known]
+
+    tmp = f'{directory}.tmp-{os.getpid()}'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for name, values in columns.items():
+        np.save(os.path.join(tmp, f'{name}.npy'), np.asarray(values))
+    meta = {
+        'built_at': time.time(),
+        'visits': len(visit_ids),
+        'items': len(item_visit_ids),
+        'categories': categories.labels(),
+        'makes': makes.labels(),
+        'parts': part_labels,
+    }
+    with open(os.path.join(tmp, META), 'w') as f:
+        json.dump(meta, f)
+
+    old = f'{directory}.old-{os.getpid()}'
+    if os.path.exists(directory):
+        os.rename(directory, old)
+    os.rename(tmp, directory)
+    shutil.rmtree(old, ignore_errors=True)
+    return {'visits': meta['visits'], 'items': meta['items']}
+
+
+class Snapshot:
+    def __init__(self, directory):
+        _require_numpy()
+        with open(os.path.join(directory, META)) as f:
+            meta = json.load(f)
+        self.directory = directory
+        self.built_at = meta['built_at']
+        self.categories = meta['categories']
+        self.makes = meta['makes']
+        self.parts = {int(part_id): labels for part_id, labels in meta['parts'].items()}
+        for name in (*VISIT_COLUMNS, *ITEM_COLUMNS):
+            setattr(self, name, np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r'))
+
+    @classmethod
+    def stamp(cls, directory):
+        """Changes whenever a new snapshot is swapped in; None when there is none."""
+        try:
+            return os.stat(os.path.join(directory, META)).st_mtime_ns
+        except OSError:
+            return None
+
+    def last_day(self):
+        return date.fromordinal(int(self.day.max())) if len(self.day) else date.today()
+
+    def revenue_by(self, field, date_from=None, date_to=None):
+        """[(label, revenue in cents, visits)] per visit category or vehicle make, highest revenue first."""
+        labels = {'category': self.categories, 'make': self.makes}[field]
+        codes = getattr(self, field)
+        mask = np.ones(len(codes), dtype=bool)
+        if date_from:
+            mask &= self.day >= date_from.toordinal()
+        if date_to:
+            mask &= self.day < date_to.toordinal()
+        revenue = np.bincount(codes[mask], weights=self.total[mask], minlength=len(labels))
+        visits = np.bincount(codes[mask], minlength=len(labels))
+        order = np.argsort(-revenue, kind='stable')
+        return [(labels[i], int(revenue[i]), int(visits[i])) for i in order if visits[i]]
+
+    def weekly_parts(self, weeks=12, end=None):
+        """(week start dates, part ids, quantities[part, week]) of the `weeks` weeks up to `end`."""
+        end = end or self.last_day()
+        first = end - timedelta(days=end.weekday() + 7 * (weeks - 1))  # Monday of the first week
+        item_day = self.day[self.visit]
+        mask = (item_day >= first.toordinal()) & (item_day < first.toordinal() + 7 * weeks) & (self.part >= 0)
+        part_ids, part_index = np.unique(self.part[mask], return_inverse=True)
+        week = (item_day[mask] - first.toordinal()) // 7
+        quantities = np.bincount(part_index * weeks + week, weights=self.quantity[mask],
+                                 minlength=len(part_ids) * weeks).reshape(len(part_ids), weeks)
+        return [first + timedelta(weeks=n) for n in range(weeks)], part_ids, quantities
+
+    def demand_forecast(self, weeks=12, window=4, top=20, end=None):
+        """Next week's demand per part as the moving average of the last `window` weeks, top parts first.
+
+        By default the weeks end with the last complete week of the snapshot,
+        so a week still in progress does not drag the average down.
+        """
+        window = max(1, min(window, weeks))
+        if end is None:
+            last = self.last_day()
+            end = last - timedelta(days=(last.weekday() + 1) % 7)  # the Sunday ending the last full week
+        week_starts, part_ids, quantities = self.weekly_parts(weeks, end)
+        totals = np.cumsum(np.pad(quantities, ((0, 0), (1, 0))), axis=1)
+        moving = (totals[:, window:] - totals[:, :-window]) / window  # average of each window ending at a week
+        forecast = moving[:, -1] if len(part_ids) else np.zeros(0)
+        order = np.argsort(-forecast, kind='stable')[:top]
+        return week_starts, [{
+            'part_id': int(part_ids[i]),
+            'name': self.parts.get(int(part_ids[i]), [UNKNOWN, None])[0],
+            'part_number': self.parts.get(int(part_ids[i]), [UNKNOWN, None])[1],
+            'weekly': quantities[i].astype(int).tolist(),
+            'moving_average': [round(float(value), 2) for value in moving[i]],
+            'forecast': round(float(forecast[i]), 2),
+        } for i in order]
@@ -1,30 +1,104 @@
-from flask import Flask, render_template, redirect, url_for, request, session, flash
+from flask import Flask, render_template, redirect, url_for, request, session, flash, abort, jsonify, g
+from flask import Response, stream_with_context, has_request_context
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
 import os
+import hashlib
+import heapq
+import threading
+import time
+import uuid
+import click
 from flask import send_file
-import io
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-from datetime import datetime
-from flask_migrate import Migrate
-
-app = Flask(__name__)
-app.config['SECRET_KEY'] = 'your_secret_key_here'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///garage.db'
+from werkzeug.utils import secure_filename
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal, ROUND_HALF_UP
+from flask_migrate import Migrate, upgrade
+from sqlalchemy import event, text
+from sqlalchemy.orm import joinedload, selectinload, Session as SASession
+import database
+import search
+import reports
+import importer
+import exporter
+import metrics
+import fragments
+import typeahead
+import archive
+from cache import TTLCache
+from markupsafe import Markup
+
+app = Flask(__name__, instance_path=os.environ.get('INSTANCE_PATH'))  # absolute path; default ./instance
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your_secret_key_here')  # must be the same in every worker
+app.config['SQLALCHEMY_DATABASE_URI'] = database.database_url()
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = database.engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+app.config['SQLITE_PRAGMAS'] = database.sqlite_pragmas()
+if database.replica_url(app.config['SQLALCHEMY_DATABASE_URI']):
+    app.config['SQLALCHEMY_BINDS'] = {database.REPLICA: database.replica_url(app.config['SQLALCHEMY_DATABASE_URI'])}
+app.config['READ_YOUR_WRITES_SECONDS'] = 10  # requests after a write read from the primary for this long
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
+app.config['REPORT_CACHE_DIR'] = os.path.join(app.instance_path, 'report_cache')
+app.config['REPORT_WORKERS'] = 2
+app.config['REPORT_BATCH_SIZE'] = 200  # visits loaded per round trip while drawing a report
+app.config['FLEET_REPORT_PROCESSES'] = min(4, os.cpu_count() or 1)
+app.config['FLEET_REPORT_MAX_VEHICLES'] = 500
+app.config['DASHBOARD_STATS_TTL'] = 300
+app.config['USER_ROLE_TTL'] = 60
+app.config['IMPORT_CHUNK_SIZE'] = importer.DEFAULT_CHUNK_SIZE
+app.config['EXPORT_BATCH_SIZE'] = 1000  # rows fetched per round trip while streaming an export
+app.config['SLOW_QUERY_MS'] = float(os.environ.get('SLOW_QUERY_MS', 200))
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')  # bearer token required by /metrics when set
+app.config['PRELOAD_REPORT_ASSETS'] = os.environ.get('PRELOAD_REPORT_ASSETS', '1') != '0'  # see serving_app()
+app.config['CUSTOMER_INDEX_MAX_AGE'] = 300  # seconds before a worker rebuilds its customer typeahead index
+app.config['PART_INDEX_MAX_AGE'] = 300  # seconds before a worker rebuilds its part autocomplete index
+app.config['ANALYTICS_DIR'] = os.path.join(app.instance_path, 'analytics')
+app.config['ANALYTICS_MAX_AGE'] = 3600  # seconds before the analytics snapshot is rebuilt in the background
+app.config['FRAGMENT_CACHE'] = os.environ.get('FRAGMENT_CACHE', 'memory')  # memory, sqlite or none
+app.config['FRAGMENT_CACHE_MAX_ENTRIES'] = 20000
+app.config['FRAGMENT_CACHE_MAX_BYTES'] = 32 * 1024 * 1024
+app.config['FRAGMENT_CACHE_PATH'] = os.path.join(app.instance_path, 'fragments.db')  # sqlite backend, shared by workers
+app.config['ARCHIVE_PATH'] = os.environ.get('ARCHIVE_PATH', os.path.join(app.instance_path, 'archive.db'))
+app.config['ARCHIVE_AFTER_DAYS'] = int(os.environ.get('ARCHIVE_AFTER_DAYS', 3 * 365))  # see `flask archive-visits`
+app.config['ARCHIVE_BATCH_SIZE'] = archive.DEFAULT_BATCH_SIZE
+db = SQLAlchemy(app, session_options={'class_': database.RoutingSession})
+migrate = Migrate(app, db, include_object=search.include_object)
+request_metrics = metrics.RequestMetrics(app)
+with app.app_context():
+    for engine in db.engines.values():
+        request_metrics.watch_engine(engine)
+    database.install_pragmas(db.engine, app.config['SQLITE_PRAGMAS'])
+    if database.REPLICA in db.engines:
+        database.install_pragmas(db.engines[database.REPLICA], database.replica_pragmas(app.config['SQLITE_PRAGMAS']))
+report_cache = reports.ReportCache(app.config['REPORT_CACHE_DIR'])
+report_jobs = reports.ReportJobQueue(report_cache, max_workers=app.config['REPORT_WORKERS'])
+fleet_cache = reports.ReportCache(os.path.join(app.instance_path, 'fleet_reports'))
+fleet_jobs = reports.ReportJobQueue(fleet_cache, max_workers=1)  # one fleet render at a time
+report_assets = reports.ReportAssets(os.path.join(app.root_path, 'static', 'powertune.jpg'))
+stats_cache = TTLCache(app.config['DASHBOARD_STATS_TTL'])
+user_roles = TTLCache(app.config['USER_ROLE_TTL'])  # user id -> role
+customer_index = typeahead.PrefixIndex(typeahead.customer_keys, max_age=app.config['CUSTOMER_INDEX_MAX_AGE'])
+part_index = typeahead.RankedPrefixIndex(typeahead.part_keys, max_age=app.config['PART_INDEX_MAX_AGE'])
+fragment_cache = fragments.FragmentCache(fragments.make_backend(
+    app.config['FRAGMENT_CACHE'], max_entries=app.config['FRAGMENT_CACHE_MAX_ENTRIES'],
+    max_bytes=app.config['FRAGMENT_CACHE_MAX_BYTES'], path=app.config['FRAGMENT_CACHE_PATH'],
+))
+visit_archive = archive.VisitArchive(app.config['ARCHIVE_PATH'])
+
+# VehicleHistory model: append-only timeline of a vehicle, written by _log_vehicle_events()
+HISTORY_EVENTS = ('created', 'status', 'technician', 'visit', 'note')
 
-# VehicleHistory model
 class VehicleHistory(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicle.id'), nullable=False)
-    date = db.Column(db.String(20), nullable=False)
+    # SQLite index entries end with the rowid, so this index also serves "entries of a vehicle by id"
+    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicle.id'), nullable=False, index=True)
+    event_type = db.Column(db.String(20), nullable=False, default='note', server_default='note')  # HISTORY_EVENTS
+    date = db.Column(db.String(20), nullable=False)  # day the event happened, YYYY-MM-DD
     timestamp = db.Column(db.DateTime, nullable=False, default=db.func.current_timestamp())
     description = db.Column(db.Text, nullable=False)
     technician = db.Column(db.String(100), nullable=True)
-    vehicle = db.relationship('Vehicle', backref='history_entries')
+    visit_id = db.Column(db.Integer, nullable=True)  # the visit of a 'visit' event
+    username = db.Column(db.String(80), nullable=True)  # who made the change, when known
+    vehicle = db.relationship('Vehicle')
 
 # User model
 
@@ -51,8 +125,12 @@ class Vehicle(db.Model):
     status = db.Column(db.String(50), nullable=False)
     date_booked = db.Column(db.String(20), nullable=True)
     technician = db.Column(db.String(100), nullable=True)  # Technician working on vehicle
-    history = db.Column(db.Text, nullable=True)  # Track work done
-    customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'), nullable=True)
+    customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'), nullable=True, index=True)
+    # Bumped by every ORM update; feed the ETag/Last-Modified validators of the vehicle pages
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1',
+                        onupdate=db.literal_column('version + 1'))
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow,
+                           server_default=db.func.current_timestamp())
     customer = db.relationship('Customer', backref='vehicles')
 
 # Customer model
@@ -62,33 +140,104 @@ class Customer(db.Model):
     phone = db.Column(db.String(20), nullable=False)
     email = db.Column(db.String(100), nullable=False)
 
+CENT = Decimal('0.01')
+
+def to_money(value):
+    """Round a price entered as float/str/int to an exact Decimal amount."""
+    return Decimal(str(value or 0)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+class Money(db.TypeDecorator):
+    """Currency amount stored as integer cents and returned as a Decimal."""
+    impl = db.Integer
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return int(to_money(value) * 100)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return Decimal(value).scaleb(-2)
+
 class ServiceVisit(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicle.id'), nullable=False)
-    date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
     notes = db.Column(db.String(255))
     visit_category = db.Column(db.String(100))  # instead of visit_type
     labour = db.Column(db.Float, default=0.0)
+    # Totals are materialized from the items whenever a visit is written
+    parts_total = db.Column(Money, nullable=False, default=0, server_default='0')
+    items_labour_total = db.Column(Money, nullable=False, default=0, server_default='0')
+    grand_total = db.Column(Money, nullable=False, default=0, server_default='0')
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1',
+                        onupdate=db.literal_column('version + 1'))
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow,
+                           server_default=db.func.current_timestamp())
     items = db.relationship('ServiceItem', backref='visit', lazy=True)
+    vehicle = db.relationship('Vehicle')
+
+    # Serves both "visits of a vehicle" lookups and their newest-first ordering
+    __table_args__ = (db.Index('ix_service_visit_vehicle_id_date', vehicle_id, date.desc()),)
+
+    def update_totals(self, items=None):
+        items = self.items if items is None else items
+        self.parts_total = sum((to_money(item.price) * item.quantity for item in items), Decimal('0.00'))
+        self.items_labour_total = sum((to_money(item.labour) for item in items), Decimal('0.00'))
+        self.grand_total = self.parts_total + self.items_labour_total + to_money(self.labour)
+
+def part_key(name, part_number):
+    """Catalogue key of an item; matches PART_KEY_SQL."""
+    return f"{(name or '').strip().lower()}|{(part_number or '').strip().lower()}"
+
+PART_KEY_SQL = "lower(trim(service_item.item_name)) || '|' || lower(trim(coalesce(service_item.part_number, '')))"
+
+class Part(db.Model):
+    """Catalogue entry shared by all service items with the same name and part number."""
+    id = db.Column(db.Integer, primary_key=True)
+    lookup_key = db.Column(db.String(210), nullable=False, unique=True)  # part_key()
+    name = db.Column(db.String(100), nullable=False)
+    part_number = db.Column(db.String(100), nullable=True)
+    # Maintained as items are added, for ranking and prefilling the autocomplete
+    usage_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    last_price = db.Column(db.Float, nullable=True)
 
 class ServiceItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    visit_id = db.Column(db.Integer, db.ForeignKey('service_visit.id'), nullable=False)
+    visit_id = db.Column(db.Integer, db.ForeignKey('service_visit.id'), nullable=False, index=True)
+    part_id = db.Column(db.Integer, db.ForeignKey('part.id'), nullable=True, index=True)
     item_name = db.Column(db.String(100), nullable=False)
     part_number = db.Column(db.String(100), nullable=True)  # <-- Add this line
     quantity = db.Column(db.Integer, nullable=False, default=1)
     price = db.Column(db.Float, nullable=False, default=0.0)
     labour = db.Column(db.Float, nullable=False, default=0.0)
+    part = db.relationship('Part')
 
-# Create default admin and initialize DB at startup
-def create_admin():
-    with app.app_context():
-        db.create_all()
-        if not User.query.filter_by(username='admin').first():
-            admin = User(username='admin')
-            admin.set_password('admin')
-            db.session.add(admin)
-            db.session.commit()
+search.attach(Vehicle.__table__)
+search.attach(Customer.__table__)
+
+# One-time setup; the server never creates tables or users on startup
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Create or upgrade the database schema (same as `flask db upgrade`)."""
+    upgrade()
+    click.echo('Database is up to date. Run `flask create-admin` to add the first admin user.')
+
+@app.cli.command('create-admin')
+@click.option('--username', default='admin', show_default=True)
+@click.password_option()
+def create_admin_command(username, password):
+    """Create an admin user."""
+    if User.query.filter_by(username=username).first():
+        raise click.ClickException(f'User {username!r} already exists.')
+    admin = User(username=username, role='admin')
+    admin.set_password(password)
+    db.session.add(admin)
+    db.session.commit()
+    click.echo(f'Created admin user {username!r}.')
 
 def login_required(f):
     from functools import wraps
@@ -100,6 +249,262 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def current_user():
+    """The logged-in User, loaded at most once per request."""
+    if 'current_user' not in g:
+        g.current_user = db.session.get(User, session['user_id']) if 'user_id' in session else None
+    return g.current_user
+
+def current_role():
+    """Role of the logged-in user, served from the process-wide role cache."""
+    if 'current_role' not in g:
+        user_id = session.get('user_id')
+        if user_id is None:
+            g.current_role = None
+        elif 'current_user' in g:
+            g.current_role = g.current_user and g.current_user.role
+        else:
+            g.current_role = user_roles.get_or_set(
+                user_id, lambda: db.session.query(User.role).filter_by(id=user_id).scalar()
+            )
+    return g.current_role
+
+def role_required(role, message=None, endpoint='dashboard'):
+    """Redirect to `endpoint` with `message` unless the logged-in user has `role`."""
+    from functools import wraps
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if current_role() != role:
+                flash(message or f'Only {role} can do that.', 'danger')
+                return redirect(url_for(endpoint))
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+@app.context_processor
+def inject_role():
+    return {'is_admin': current_role() == 'admin'}
+
+@event.listens_for(SASession, 'before_flush')
+def _track_user_writes(session, flush_context, instances):
+    for obj in (*session.dirty, *session.deleted):
+        if isinstance(obj, User):
+            session.info.setdefault('changed_users', set()).add(obj.id)
+
+@event.listens_for(SASession, 'after_commit')
+def _invalidate_roles(session):
+    for user_id in session.info.pop('changed_users', ()):
+        user_roles.invalidate(user_id)
+
+@event.listens_for(SASession, 'after_rollback')
+def _forget_user_writes(session):
+    session.info.pop('changed_users', None)
+
+# HTTP validators: pages answer conditional GETs with 304 before rendering anything
+
+def _page_salt():
+    # Templates or code changing after a deploy must not be masked by old ETags
+    paths = [os.path.join(app.root_path, 'app.py')]
+    template_dir = os.path.join(app.root_path, 'templates')
+    paths += [os.path.join(template_dir, name) for name in sorted(os.listdir(template_dir))]
+    return hashlib.sha1(repr([os.stat(path).st_mtime_ns for path in paths]).encode()).hexdigest()[:8]
+
+PAGE_SALT = _page_salt()
+
+def page_etag(*parts):
+    """Strong ETag of a rendered page from the state it was built from and the viewer's role."""
+    return hashlib.sha1(repr((PAGE_SALT, current_role()) + parts).encode()).hexdigest()
+
+def not_modified(etag, last_modified=None):
+    """A 304 response when the request's validators still match, otherwise None."""
+    if session.get('_flashes'):
+        return None  # the page would show pending messages
+    if request.if_none_match:
+        matched = request.if_none_match.contains(etag)
+    elif request.if_modified_since and last_modified:
+        matched = last_modified.replace(tzinfo=timezone.utc, microsecond=0) <= request.if_modified_since
+    else:
+        matched = False
+    if not matched:
+        return None
+    return with_validators(Response(status=304), etag, last_modified)
+
+def with_validators(response, etag, last_modified=None):
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified.replace(tzinfo=timezone.utc)
+    # Browsers may keep the page but must revalidate it; it depends on the logged-in user
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+def customer_digest(c):
+    return c and (c.id, c.name, c.phone, c.email)
+
+def vehicle_state(v):
+    """(ETag parts, last modified) of a vehicle, its visit history and its timeline."""
+    last_event = (db.session.query(VehicleHistory.id, VehicleHistory.timestamp)
+                  .filter(VehicleHistory.vehicle_id == v.id).order_by(VehicleHistory.id.desc()).limit(1))
+    visit_count, last_visit_id, visits_updated, last_event_id, last_event_at = db.session.query(
+        db.func.count(ServiceVisit.id), db.func.max(ServiceVisit.id), db.func.max(ServiceVisit.updated_at),
+        last_event.with_entities(VehicleHistory.id).scalar_subquery(),
+        last_event.with_entities(VehicleHistory.timestamp).scalar_subquery(),
+    ).filter(ServiceVisit.vehicle_id == v.id).one()
+    parts = (v.id, v.version, visit_count, last_visit_id, str(visits_updated), last_event_id,
+             customer_digest(v.customer))
+    return parts, max(filter(None, (v.updated_at, visits_updated, last_event_at)))
+
+# Static files are linked as /static/<file>?v=<content hash> and cached for a year
+
+_static_versions = {}
+
+@app.url_defaults
+def fingerprint_static(endpoint, values):
+    if endpoint != 'static' or 'v' in values or 'filename' not in values:
+        return
+    path = os.path.join(app.static_folder, values['filename'])
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    version = _static_versions.get(path)
+    if version is None or version[0] != key:
+        with open(path, 'rb') as f:
+            version = _static_versions[path] = (key, hashlib.md5(f.read()).hexdigest()[:10])
+    values['v'] = version[1]
+
+@app.after_request
+def cache_fingerprinted_static(response):
+    if request.endpoint == 'static' and request.args.get('v') and response.status_code in (200, 304):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = 365 * 24 * 3600
+        response.cache_control.immutable = True
+    return response
+
+# Rendered fragments: vehicle rows and visit cards are rendered once per version (see fragments.py)
+
+FRAGMENT_ROLES = ('admin', 'user')
+
+def render_fragment(template, **context):
+    # Rendered straight from the Jinja environment, which sends no template signals, so timed here
+    with request_metrics.template_timer():
+        return Markup(app.jinja_env.get_template(template).render(**context))
+
+def vehicle_rows(vehicles):
+    """Table rows of `vehicles`; the actions cell depends on the viewer's role."""
+    role = current_role()
+    is_admin = role == 'admin'
+    return [Markup(html) for html in fragment_cache.render_many(
+        vehicles,
+        key=lambda v: f'vehicle_row:{v.id}:{role}',
+        token=lambda v: f'{PAGE_SALT}:{v.version}',
+        render=lambda misses: [render_fragment('vehicle_row.html', v=v, is_admin=is_admin) for v in misses],
+    )]
+
+def visit_cards(visits):
+    """History cards of `visits`; items are only loaded for the cards not cached."""
+    def render(misses):
+        items = {}
+        archived = {visit.id: visit.items for visit in misses if getattr(visit, 'archived', False)}
+        ids = [visit.id for visit in misses if visit.id not in archived]  # archived visits carry their items
+        if ids:
+            for item in ServiceItem.query.filter(ServiceItem.visit_id.in_(ids)).order_by(ServiceItem.id):
+                items.setdefault(item.visit_id, []).append(item)
+        return [render_fragment('visit_card.html', visit=visit, items=archived.get(visit.id, items.get(visit.id, [])))
+                for visit in misses]
+    return [Markup(html) for html in fragment_cache.render_many(
+        visits,
+        key=lambda visit: f'visit_card:{visit.id}',
+        token=lambda visit: f'{PAGE_SALT}:{visit.version}',
+        render=render,
+    )]
+
+@event.listens_for(SASession, 'after_flush')
+def _invalidate_fragments(session, flush_context):
+    # The version check already keeps stale fragments out; this frees them right away
+    keys = []
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, Vehicle) and obj not in session.new:
+            keys += [f'vehicle_row:{obj.id}:{role}' for role in FRAGMENT_ROLES]
+        elif isinstance(obj, ServiceVisit) and obj not in session.new:
+            keys.append(f'visit_card:{obj.id}')
+        elif isinstance(obj, ServiceItem) and obj.visit_id is not None:
+            keys.append(f'visit_card:{obj.visit_id}')
+    if keys:
+        fragment_cache.invalidate(keys)
+
+# Keyset pagination for list views
+DEFAULT_PAGE_SIZE = 25
+MAX_PAGE_SIZE = 100
+
+class Page:
+    def __init__(self, items, per_page, next_args=None, prev_args=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_args = next_args  # query args for the next page, e.g. {'after': 42}
+        self.prev_args = prev_args  # query args for the previous page
+
+def page_args():
+    per_page = request.args.get('per_page', DEFAULT_PAGE_SIZE, type=int)
+    per_page = max(1, min(per_page, MAX_PAGE_SIZE))
+    after = request.args.get('after', type=int)
+    before = request.args.get('before', type=int)
+    return per_page, after, before
+
+def keyset_paginate(query, column, per_page, after=None, before=None, descending=False):
+    """Return a Page of `query` ordered by the unique `column`.
+
+    Only per_page + 1 rows are fetched, so the cost of a page does not depend
+    on how far into the table it is. With `descending` the pages run from the
+    highest key down (newest first); `after` still means the next page.
+    """
+    key = column.key
+    forward, backward = (column.desc(), column.asc()) if descending else (column.asc(), column.desc())
+    if before is not None:
+        earlier = column > before if descending else column < before
+        rows = query.filter(earlier).order_by(backward).limit(per_page + 1).all()
+        has_prev = len(rows) > per_page
+        rows = list(reversed(rows[:per_page]))
+        if not rows:
+            return Page(rows, per_page)
+        return Page(
+            rows, per_page,
+            next_args={'after': getattr(rows[-1], key)},
+            prev_args={'before': getattr(rows[0], key)} if has_prev else None
+        )
+    if after is not None:
+        query = query.filter(column < after if descending else column > after)
+    rows = query.order_by(forward).limit(per_page + 1).all()
+    has_next = len(rows) > per_page
+    rows = rows[:per_page]
+    if not rows:
+        return Page(rows, per_page)
+    return Page(
+        rows, per_page,
+        next_args={'after': getattr(rows[-1], key)} if has_next else None,
+        prev_args={'before': getattr(rows[0], key)} if after is not None else None
+    )
+
+def search_paginate(model, q, per_page):
+    """Return a Page of `model` rows matching `q`, ranked by the FTS index.
+
+    Ranked results have no stable key to seek on, so search pages use an
+    offset into the (small) match set instead of a keyset cursor.
+    """
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    ids = search.search_ids(db.session, model.__tablename__, q, per_page + 1, offset)
+    has_next = len(ids) > per_page
+    ids = ids[:per_page]
+    by_id = {row.id: row for row in model.query.filter(model.id.in_(ids))} if ids else {}
+    return Page(
+        [by_id[i] for i in ids if i in by_id], per_page,
+        next_args={'offset': offset + per_page} if has_next else None,
+        prev_args={'offset': max(offset - per_page, 0)} if offset else None
+    )
+
 @app.route('/')
 def index():
     return redirect(url_for('login'))
@@ -127,48 +532,207 @@ def logout():
 
 
 # Dashboard
-        # VehicleHistory model
+# Dashboard statistics are SQL aggregates cached for DASHBOARD_STATS_TTL seconds
+# and dropped as soon as a visit, item or vehicle write is committed.
+PERIOD_FORMATS = {
+    # period: (SQLite strftime format, PostgreSQL to_char format)
+    'day': ('%Y-%m-%d', 'YYYY-MM-DD'),
+    'week': ('%Y-W%W', 'IYYY-"W"IW'),
+    'month': ('%Y-%m', 'YYYY-MM'),
+}
+STATS_WINDOWS = {'day': timedelta(days=14), 'week': timedelta(weeks=12), 'month': timedelta(days=365)}
+
+def period_label(column, period):
+    sqlite_format, pg_format = PERIOD_FORMATS[period]
+    if db.engine.dialect.name == 'sqlite':
+        return db.func.strftime(sqlite_format, column)
+    return db.func.to_char(column, pg_format)
+
+def day_sql(column):
+    """SQL text for the YYYY-MM-DD day of `column`, for raw statements."""
+    sqlite_format, pg_format = PERIOD_FORMATS['day']
+    if db.engine.dialect.name == 'sqlite':
+        return f"strftime('{sqlite_format}', {column})"
+    return f"to_char({column}, '{pg_format}')"
+
+def compute_dashboard_stats():
+    now = datetime.utcnow()
+    revenue = {}
+    for period, window in STATS_WINDOWS.items():
+        label = period_label(ServiceVisit.date, period).label('period')
+        rows = (db.session.query(label, db.func.sum(ServiceVisit.grand_total), db.func.count(ServiceVisit.id))
+                .filter(ServiceVisit.date >= now - window)
+                .group_by(label).order_by(label).all())
+        revenue[period] = [{'period': p, 'revenue': str(total or 0), 'visits': count} for p, total, count in rows]
+
+    recent = now - timedelta(days=90)
+    categories = (db.session.query(ServiceVisit.visit_category, db.func.count(ServiceVisit.id))
+                  .filter(ServiceVisit.date >= recent)
+                  .group_by(ServiceVisit.visit_category)
+                  .order_by(db.func.count(ServiceVisit.id).desc()).all())
+    quantity = db.func.sum(ServiceItem.quantity)
+    top_parts = (db.session.query(ServiceItem.part_number, db.func.max(ServiceItem.item_name), quantity,
+                                  db.func.sum(ServiceItem.quantity * ServiceItem.price))
+                 .join(ServiceVisit, ServiceItem.visit_id == ServiceVisit.id)
+                 .filter(ServiceVisit.date >= recent, ServiceItem.part_number.isnot(None), ServiceItem.part_number != '')
+                 .group_by(ServiceItem.part_number)
+                 .order_by(quantity.desc()).limit(10).all())
+    workload = (db.session.query(Vehicle.technician, db.func.count(Vehicle.id))
+                .filter(Vehicle.status == 'Active')
+                .group_by(Vehicle.technician)
+                .order_by(db.func.count(Vehicle.id).desc()).all())
+    return {
+        'vehicle_count': Vehicle.query.count(),
+        'customer_count': Customer.query.count(),
+        'active_vehicles': Vehicle.query.filter_by(status='Active').count(),
+        'vehicles_serviced_30d': db.session.query(db.func.count(db.distinct(ServiceVisit.vehicle_id)))
+                                 .filter(ServiceVisit.date >= now - timedelta(days=30)).scalar(),
+        'revenue': revenue,
+        'visits_by_category': [{'category': c or 'Uncategorized', 'visits': n} for c, n in categories],
+        'top_parts': [{'part_number': p, 'item_name': name, 'quantity': int(q or 0), 'revenue': round(r or 0, 2)}
+                      for p, name, q, r in top_parts],
+        'technician_workload': [{'technician': t or 'Unassigned', 'active_vehicles': n} for t, n in workload],
+        'generated_at': now.isoformat(timespec='seconds'),
+    }
+
+def dashboard_stats():
+    return stats_cache.get_or_set('dashboard', compute_dashboard_stats)
+
+@event.listens_for(SASession, 'before_flush')
+def _track_stats_writes(session, flush_context, instances):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, (ServiceVisit, ServiceItem, Vehicle, Customer)):
+            session.info['stats_dirty'] = True
+            return
+
+@event.listens_for(SASession, 'before_flush')
+def _touch_visits(session, flush_context, instances):
+    # Item changes bump their visit, so the visit's version covers its items
+    with session.no_autoflush:
+        for obj in (*session.new, *session.dirty, *session.deleted):
+            if isinstance(obj, ServiceItem) and obj.visit is not None and obj.visit not in session.new:
+                obj.visit.updated_at = datetime.utcnow()
+
+@event.listens_for(SASession, 'after_commit')
+def _invalidate_stats(session):
+    if session.info.pop('stats_dirty', False):
+        stats_cache.invalidate()
+
+@event.listens_for(SASession, 'after_rollback')
+def _forget_stats_writes(session):
+    session.info.pop('stats_dirty', None)
+
 @app.route('/dashboard')
 @login_required
+@database.read_only
 def dashboard():
-    vehicle_count = Vehicle.query.count()
-    customer_count = Customer.query.count()
-    return render_template('dashboard.html', vehicle_count=vehicle_count, customer_count=customer_count)
+    stats = dashboard_stats()
+    return render_template('dashboard.html', vehicle_count=stats['vehicle_count'],
+                           customer_count=stats['customer_count'], stats=stats)
+
+@app.route('/dashboard/stats')
+@login_required
+@database.read_only
+def dashboard_stats_json():
+    return jsonify(dashboard_stats())
 
 # VEHICLE CRUD
 
+def visit_history(vehicle_id, full_history=False):
+    # Items are not loaded here: visit_cards() fetches them for uncached cards only
+    visits = (ServiceVisit.query
+              .filter_by(vehicle_id=vehicle_id)
+              .order_by(ServiceVisit.date.desc())
+              .all())
+    if full_history:
+        hot_ids = {visit.id for visit in visits}
+        visits += [visit for visit in visit_archive.visits(vehicle_id) if visit.id not in hot_ids]
+        visits.sort(key=visit_order, reverse=True)
+    return visits
+
+def visit_order(visit):
+    return visit.date, visit.id
+
+def iter_visit_history(vehicle_id, batch_size=None, date_from=None, date_to=None, full_history=False):
+    """Yield a vehicle's visits newest first, `batch_size` visits (with items) at a time.
+
+    Visits already yielded are not kept alive by the session, so memory stays
+    bounded by the batch size however long the history is. With
+    `full_history` the archived visits are merged in, decompressed one by one.
+    """
+    visits = _iter_visits(vehicle_id, batch_size, date_from, date_to)
+    if not full_history:
+        return visits
+    # A visit changed while it was being archived is in both databases until the next run
+    hot_ids = {visit_id for (visit_id,) in db.session.query(ServiceVisit.id).filter_by(vehicle_id=vehicle_id)}
+    archived = (visit for visit in visit_archive.visits(vehicle_id, date_from, date_to) if visit.id not in hot_ids)
+    return heapq.merge(visits, archived, key=visit_order, reverse=True)
+
+def _iter_visits(vehicle_id, batch_size=None, date_from=None, date_to=None):
+    batch_size = batch_size or app.config['REPORT_BATCH_SIZE']
+    query = ServiceVisit.query.filter_by(vehicle_id=vehicle_id)
+    if date_from:
+        query = query.filter(ServiceVisit.date >= date_from)
+    if date_to:
+        query = query.filter(ServiceVisit.date < date_to)
+    query = (query
+             .options(selectinload(ServiceVisit.items))
+             .order_by(ServiceVisit.date.desc(), ServiceVisit.id.desc())
+             .yield_per(batch_size))
+    for visit in query:
+        yield visit
+
 @app.route('/vehicles')
 @login_required
+@database.read_only
 def vehicles():
     q = request.args.get('q', '').strip()
+    per_page, after, before = page_args()
+    if q and search.is_available(db.session, 'vehicle'):
+        page = search_paginate(Vehicle, q, per_page)
+        return render_template('vehicles.html', rows=vehicle_rows(page.items), page=page, q=q)
+    query = Vehicle.query
     if q:
-        vehicles = Vehicle.query.filter(
+        query = query.filter(
             (Vehicle.plate.ilike(f'%{q}%')) |
             (Vehicle.model.ilike(f'%{q}%')) |
             (Vehicle.name.ilike(f'%{q}%'))
-        ).all()
-    else:
-        vehicles = Vehicle.query.all()
-    return render_template('vehicles.html', vehicles=vehicles)
+        )
+    page = keyset_paginate(query, Vehicle.id, per_page, after=after, before=before)
+    return render_template('vehicles.html', rows=vehicle_rows(page.items), page=page, q=q)
 
 
 # Vehicle detail and add history record
 @app.route('/vehicles/<int:vehicle_id>', methods=['GET', 'POST'])
 @login_required
+@database.read_only
 def vehicle_detail(vehicle_id):
-    v = Vehicle.query.get_or_404(vehicle_id)
-    visits = ServiceVisit.query.filter_by(vehicle_id=vehicle_id).order_by(ServiceVisit.date.desc()).all()
-    return render_template('vehicle_detail.html', vehicle=v, visits=visits)
+    v = Vehicle.query.options(joinedload(Vehicle.customer)).get_or_404(vehicle_id)
+    parts, last_modified = vehicle_state(v)
+    full_history = request.args.get('full_history') == '1'
+    archived_count = visit_archive.count(vehicle_id)
+    etag = page_etag('vehicle_detail', *parts, full_history, archived_count)
+    cached = not_modified(etag, last_modified)
+    if cached:
+        return cached
+    visits = visit_history(vehicle_id, full_history)
+    events = timeline_query(vehicle_id).order_by(VehicleHistory.id.desc()).limit(RECENT_EVENTS).all()
+    response = app.make_response(render_template('vehicle_detail.html', vehicle=v, visit_cards=visit_cards(visits),
+                                                 events=events, full_history=full_history,
+                                                 archived_count=archived_count))
+    return with_validators(response, etag, last_modified)
 
 @app.route('/vehicles/add', methods=['GET', 'POST'])
 @login_required
 def add_vehicle():
-    customers = Customer.query.all()
-    if not customers:
+    if request.method == 'GET' and not db.session.query(Customer.query.exists()).scalar():
         flash('Please add a customer first before adding a vehicle.', 'warning')
         return redirect(url_for('add_customer'))
     if request.method == 'POST':
-        customer_id = request.form['customer_id']
+        customer = selected_customer()
+        if customer is None:
+            flash('Please select a customer.', 'danger')
+            return render_template('add_vehicle.html', customer=None)
         make = request.form['name']
         custom_make = request.form.get('custom_make', '').strip()
         name = custom_make if make == 'custom' and custom_make else make
@@ -179,12 +743,12 @@ def add_vehicle():
         status = 'Active'
         date_booked = request.form['date_booked']
         technician = request.form['technician']
-        history = request.form.get('history', '')
+        note = request.form.get('note', '').strip()
         if Vehicle.query.filter_by(plate=plate).first():
             flash('A vehicle with this plate number already exists.', 'danger')
-            return render_template('add_vehicle.html', customers=customers)
+            return render_template('add_vehicle.html', customer=customer)
         v = Vehicle(
-            customer_id=customer_id,
+            customer_id=customer.id,
             name=name,
             plate=plate,
             model=model,
@@ -192,29 +756,28 @@ def add_vehicle():
             type=type_,
             status=status,
             date_booked=date_booked,
-            technician=technician,
-            history=history
+            technician=technician
         )
         db.session.add(v)
+        if note:
+            db.session.flush()  # log the vehicle as added before its first note
+            add_vehicle_note(v, note)
         db.session.commit()
         flash('Vehicle added successfully!', 'success')
         return redirect(url_for('vehicles'))
-    return render_template('add_vehicle.html', customers=customers)
+    return render_template('add_vehicle.html', customer=None)
 
 @app.route('/vehicles/edit/<int:vehicle_id>', methods=['GET', 'POST'])
 @login_required
+@role_required('admin', 'Only admin can edit vehicles.', endpoint='vehicles')
 def edit_vehicle(vehicle_id):
-    user = User.query.get(session['user_id'])
-    if user.role != 'admin':
-        flash('Only admin can edit vehicles.', 'danger')
-        return redirect(url_for('vehicles'))
     v = Vehicle.query.get_or_404(vehicle_id)
-    customers = Customer.query.all()
-    if not customers:
-        flash('Please add a customer first before editing a vehicle.', 'warning')
-        return redirect(url_for('add_customer'))
     if request.method == 'POST':
-        v.customer_id = request.form['customer_id']
+        customer = selected_customer()
+        if customer is None:
+            flash('Please select a customer.', 'danger')
+            return render_template('edit_vehicle.html', vehicle=v, customer=v.customer)
+        v.customer_id = customer.id
         v.name = request.form['name']
         v.plate = request.form['plate']
         v.model = request.form['model']
@@ -223,39 +786,220 @@ def edit_vehicle(vehicle_id):
         v.status = request.form['status']
         v.date_booked = request.form['date_booked']
         v.technician = request.form['technician']
-        v.history = request.form.get('history', '')
+        note = request.form.get('note', '').strip()
+        if note:
+            add_vehicle_note(v, note)
         db.session.commit()
         flash('Vehicle updated!', 'success')
         return redirect(url_for('vehicles'))
-    return render_template('edit_vehicle.html', vehicle=v, customers=customers)
+    return render_template('edit_vehicle.html', vehicle=v, customer=v.customer)
 
 @app.route('/vehicles/delete/<int:vehicle_id>', methods=['POST'])
 @login_required
+@role_required('admin', 'Only admin can delete vehicles.', endpoint='vehicles')
 def delete_vehicle(vehicle_id):
-    user = User.query.get(session['user_id'])
-    if user.role != 'admin':
-        flash('Only admin can delete vehicles.', 'danger')
-        return redirect(url_for('vehicles'))
     v = Vehicle.query.get_or_404(vehicle_id)
     db.session.delete(v)
     db.session.commit()
+    visit_archive.delete_vehicle(vehicle_id)  # a later vehicle may reuse the id
     flash('Vehicle deleted!', 'info')
     return redirect(url_for('vehicles'))
 
+# Vehicle timeline: VehicleHistory entries are appended from the session events
+# below whenever a vehicle is added, changes status or technician, or gets a
+# visit; notes are added explicitly. Entries are never updated.
+
+RECENT_EVENTS = 5  # shown on the vehicle detail page
+
+def current_username():
+    return session.get('username') if has_request_context() else None
+
+def history_entry(vehicle_id, event_type, description, day=None, technician=None, visit_id=None):
+    """Row for the vehicle_history table; `day` is when the event happened (default today)."""
+    now = datetime.utcnow()
+    return {
+        'vehicle_id': vehicle_id, 'event_type': event_type, 'description': description,
+        'date': (day or now).strftime('%Y-%m-%d'), 'timestamp': now,
+        'technician': technician, 'visit_id': visit_id, 'username': current_username(),
+    }
+
+def visit_event(category, notes):
+    """Description of a visit entry; matches the SQL in log_bulk_inserts()."""
+    return f"{category or 'Service'} visit" + (f': {notes}' if notes else '')
+
+def add_vehicle_note(vehicle, text):
+    # vehicle_id is None for a vehicle not flushed yet; the relationship fills it in
+    db.session.add(VehicleHistory(vehicle=vehicle, **history_entry(vehicle.id, 'note', text,
+                                                                   technician=vehicle.technician)))
+
+def vehicle_changes(vehicle):
+    """History entries for the status and technician changes of a flushed vehicle."""
+    state = db.inspect(vehicle)
+    for field in ('status', 'technician'):  # the field name doubles as the event type
+        added, _, removed = state.attrs[field].history
+        old, new = (removed or [None])[0], (added or [None])[0]
+        if not added or old == new:
+            continue
+        label = field.capitalize()
+        if old and new:
+            description = f'{label} changed from {old} to {new}'
+        elif new:
+            description = f'{label} set to {new}'
+        else:
+            description = f'{label} cleared'
+        yield history_entry(vehicle.id, field, description, technician=vehicle.technician)
+
+@event.listens_for(SASession, 'before_flush')
+def _keep_history_append_only(session, flush_context, instances):
+    for obj in (*session.dirty, *session.deleted):
+        if isinstance(obj, VehicleHistory) and (obj in session.deleted or session.is_modified(obj)):
+            raise ValueError('Vehicle history entries cannot be changed or deleted.')
+
+@event.listens_for(SASession, 'after_flush')
+def _log_vehicle_events(session, flush_context):
+    entries = []
+    for obj in session.new:
+        if isinstance(obj, Vehicle):
+            entries.append(history_entry(obj.id, 'created', f'Vehicle added ({obj.status})',
+                                         technician=obj.technician))
+        elif isinstance(obj, ServiceVisit):
+            entries.append(history_entry(obj.vehicle_id, 'visit', visit_event(obj.visit_category, obj.notes),
+                                         day=obj.date, visit_id=obj.id))
+    for obj in session.dirty:
+        if isinstance(obj, Vehicle) and obj not in session.deleted:
+            entries += vehicle_changes(obj)
+    # The primary key values are known now, so the entries go in as one executemany
+    if entries:
+        session.execute(VehicleHistory.__table__.insert(), entries)
+    deleted = [obj.id for obj in session.deleted if isinstance(obj, Vehicle)]
+    if deleted:
+        # A later vehicle may reuse the id; it must not inherit this timeline. On SQLite the
+        # vehicle_history_ad trigger also covers vehicles deleted without the ORM.
+        session.execute(VehicleHistory.__table__.delete().where(VehicleHistory.vehicle_id.in_(deleted)))
+
+def log_bulk_inserts(kind, after_id=0):
+    """Timeline entries for vehicles or visits with id > `after_id` inserted without the ORM (imports).
+
+    Rows that already have their entry are skipped, so this can be re-run.
+    """
+    select_rows = {
+        'vehicles': f"""SELECT id, 'created', {day_sql('CURRENT_TIMESTAMP')}, CURRENT_TIMESTAMP,
+                              'Vehicle added (' || status || ')', technician, NULL, :username
+                       FROM vehicle WHERE id > :after_id AND NOT EXISTS (
+                           SELECT 1 FROM vehicle_history h WHERE h.vehicle_id = vehicle.id AND h.event_type = 'created')
+                       ORDER BY id""",
+        'visits': f"""SELECT vehicle_id, 'visit', {day_sql('date')}, CURRENT_TIMESTAMP,
+                            coalesce(visit_category, 'Service') || ' visit' || coalesce(': ' || nullif(notes, ''), ''),
+                            NULL, id, :username
+                     FROM service_visit WHERE id > :after_id AND NOT EXISTS (
+                         SELECT 1 FROM vehicle_history h
+                         WHERE h.vehicle_id = service_visit.vehicle_id AND h.visit_id = service_visit.id)
+                     ORDER BY date, id""",
+    }[kind]
+    with db.engine.begin() as conn:
+        return conn.execute(text(f"""
+            INSERT INTO vehicle_history (vehicle_id, event_type, date, timestamp, description, technician, visit_id,
+                                         username)
+            {select_rows}
+        """), {'after_id': after_id, 'username': current_username()}).rowcount
+
+def timeline_query(vehicle_id):
+    return VehicleHistory.query.filter(VehicleHistory.vehicle_id == vehicle_id)
+
+@app.route('/vehicles/<int:vehicle_id>/timeline')
+@login_required
+@database.read_only
+def vehicle_timeline(vehicle_id):
+    v = Vehicle.query.get_or_404(vehicle_id)
+    per_page, after, before = page_args()
+    page = keyset_paginate(timeline_query(vehicle_id), VehicleHistory.id, per_page,
+                           after=after, before=before, descending=True)
+    return render_template('vehicle_timeline.html', vehicle=v, page=page)
+
+@app.route('/vehicles/<int:vehicle_id>/notes', methods=['POST'])
+@login_required
+def add_note(vehicle_id):
+    v = Vehicle.query.get_or_404(vehicle_id)
+    note = request.form.get('note', '').strip()
+    if not note:
+        flash('Write a note first.', 'warning')
+    else:
+        add_vehicle_note(v, note)
+        db.session.commit()
+        flash('Note added.', 'success')
+    back = 'vehicle_detail' if request.form.get('back') == 'detail' else 'vehicle_timeline'
+    return redirect(url_for(back, vehicle_id=vehicle_id))
+
 # CUSTOMER CRUD
 @app.route('/customers')
 @login_required
+@database.read_only
 def customers():
     q = request.args.get('q', '').strip()
+    per_page, after, before = page_args()
+    if q and search.is_available(db.session, 'customer'):
+        page = search_paginate(Customer, q, per_page)
+        return render_template('customers.html', customers=page.items, page=page, q=q)
+    query = Customer.query
     if q:
-        customers = Customer.query.filter(
+        query = query.filter(
             (Customer.name.ilike(f'%{q}%')) |
             (Customer.phone.ilike(f'%{q}%')) |
             (Customer.email.ilike(f'%{q}%'))
-        ).all()
+        )
+    page = keyset_paginate(query, Customer.id, per_page, after=after, before=before)
+    return render_template('customers.html', customers=page.items, page=page, q=q)
+
+# Customer typeahead for the vehicle forms, served from the in-memory index in typeahead.py
+
+TYPEAHEAD_LIMIT = 10
+MAX_TYPEAHEAD_LIMIT = 25
+
+def refresh_customer_index():
+    if customer_index.is_stale():
+        customer_index.rebuild(db.session.query(Customer.id, Customer.name, Customer.phone))
     else:
-        customers = Customer.query.all()
-    return render_template('customers.html', customers=customers)
+        # Customers added by other workers or bulk imports since the last look
+        for row in db.session.query(Customer.id, Customer.name, Customer.phone).filter(Customer.id > customer_index.max_id):
+            customer_index.update(*row)
+
+@app.route('/customers/search')
+@login_required
+@database.read_only
+def customer_search():
+    limit = max(1, min(request.args.get('limit', TYPEAHEAD_LIMIT, type=int), MAX_TYPEAHEAD_LIMIT))
+    refresh_customer_index()
+    ids = customer_index.search(request.args.get('q', ''), limit)
+    found = {c.id: c for c in db.session.query(Customer.id, Customer.name, Customer.phone)
+             .filter(Customer.id.in_(ids))} if ids else {}
+    return jsonify(results=[{'id': c.id, 'name': c.name, 'phone': c.phone} for c in map(found.get, ids) if c])
+
+@event.listens_for(SASession, 'after_flush')
+def _track_customer_writes(session, flush_context):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, Customer):
+            fields = None if obj in session.deleted else (obj.name, obj.phone)
+            session.info.setdefault('changed_customers', {})[obj.id] = fields
+
+@event.listens_for(SASession, 'after_commit')
+def _update_customer_index(session):
+    changes = session.info.pop('changed_customers', {})
+    if customer_index.built is None:
+        return  # built from the database on first use
+    for customer_id, fields in changes.items():
+        if fields is None:
+            customer_index.remove(customer_id)
+        else:
+            customer_index.update(customer_id, *fields)
+
+@event.listens_for(SASession, 'after_rollback')
+def _forget_customer_writes(session):
+    session.info.pop('changed_customers', None)
+
+def selected_customer():
+    """The customer picked in a vehicle form, or None when the id is missing or unknown."""
+    customer_id = request.form.get('customer_id', type=int)
+    return db.session.get(Customer, customer_id) if customer_id else None
 
 @app.route('/customers/add', methods=['GET', 'POST'])
 @login_required
@@ -286,115 +1030,612 @@ def edit_customer(customer_id):
 
 @app.route('/customers/delete/<int:customer_id>', methods=['POST'])
 @login_required
+@role_required('admin', 'Only admin can delete customers.', endpoint='customers')
 def delete_customer(customer_id):
-    user = User.query.get(session['user_id'])
-    if user.role != 'admin':
-        flash('Only admin can delete customers.', 'danger')
-        return redirect(url_for('customers'))
     c = Customer.query.get_or_404(customer_id)
     db.session.delete(c)
     db.session.commit()
     flash('Customer deleted!', 'info')
     return redirect(url_for('customers'))
 
+# Bulk import of CSV/XLSX files (see importer.py)
+
+def run_import(kind, stream, filename):
+    model = {'vehicles': Vehicle, 'visits': ServiceVisit}.get(kind)
+    last_id = (db.session.query(db.func.max(model.id)).scalar() or 0) if model else 0
+    result = importer.import_rows(db.engine, db.metadata.tables, kind, importer.read_rows(stream, filename),
+                                  chunk_size=app.config['IMPORT_CHUNK_SIZE'])
+    # Core inserts bypass the session events that normally drop these
+    if result.inserted:
+        stats_cache.invalidate()
+        customer_index.invalidate()
+        if kind == 'visits':
+            link_unlinked_items()
+        if model:
+            log_bulk_inserts(kind, last_id)
+    return result
+
+@app.route('/import', methods=['GET', 'POST'])
+@login_required
+@role_required('admin', 'Only admin can import data.')
+def import_data():
+    result = error = None
+    if request.method == 'POST':
+        kind = request.form.get('kind')
+        upload = request.files.get('file')
+        if kind not in importer.KINDS or not upload or not upload.filename:
+            error = 'Choose what to import and a CSV or XLSX file.'
+        else:
+            try:
+                result = run_import(kind, upload.stream, upload.filename)
+            except ValueError as exc:
+                error = str(exc)
+        if request.accept_mimetypes.best == 'application/json':
+            return (jsonify(result.to_dict()), 200) if result else (jsonify(error=error), 400)
+        if error:
+            flash(error, 'danger')
+        else:
+            database.pin_to_primary()
+            flash(f'Imported {result.inserted} {kind}; {result.error_count} rows with errors.',
+                  'success' if not result.error_count else 'warning')
+    return render_template('import.html', result=result, kinds=importer.KINDS)
+
+@app.cli.command('import-data')
+@click.argument('kind', type=click.Choice(importer.KINDS))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--chunk-size', type=int, help='Rows per INSERT batch and transaction.')
+def import_data_command(kind, path, chunk_size):
+    """Bulk import customers, vehicles or visits from a CSV or XLSX file."""
+    if chunk_size:
+        app.config['IMPORT_CHUNK_SIZE'] = chunk_size
+    started = datetime.now()
+    with open(path, 'rb') as stream:
+        try:
+            result = run_import(kind, stream, path)
+        except ValueError as exc:
+            raise click.ClickException(str(exc))
+    elapsed = (datetime.now() - started).total_seconds()
+    for line, message in result.errors:
+        click.echo(f'line {line}: {message}', err=True)
+    if result.error_count > len(result.errors):
+        click.echo(f'... {result.error_count - len(result.errors)} more errors', err=True)
+    click.echo(f'{result.rows} rows read, {result.inserted} {kind} imported, {result.error_count} errors '
+               f'({result.duplicates} duplicates) in {elapsed:.1f}s ({result.rows / max(elapsed, 1e-6):.0f} rows/s)')
+
+# Streaming export of visits and items (see exporter.py)
+
+def parse_export_filters(values):
+    """Export filters from request/CLI values; raises ValueError."""
+    filters = {'date_from': None, 'date_to': None, 'category': None, 'customer_id': None}
+    for field in ('date_from', 'date_to'):
+        if values.get(field):
+            filters[field] = datetime.strptime(values[field], '%Y-%m-%d')
+    if filters['date_to']:
+        filters['date_to'] += timedelta(days=1)  # inclusive end date
+    if values.get('category'):
+        filters['category'] = values['category']
+    if values.get('customer_id'):
+        filters['customer_id'] = int(values['customer_id'])
+    return filters
+
+def iter_export_rows(filters):
+    """One row per visit item, oldest visit first, streamed in EXPORT_BATCH_SIZE batches."""
+    query = (db.select(ServiceVisit.id.label('visit_id'), ServiceVisit.date, Vehicle.plate,
+                       Vehicle.name.label('vehicle'), Vehicle.model, Vehicle.customer_id,
+                       Customer.name.label('customer'), ServiceVisit.visit_category, ServiceVisit.notes,
+                       ServiceVisit.labour, ServiceVisit.parts_total, ServiceVisit.items_labour_total,
+                       ServiceVisit.grand_total, ServiceItem.id.label('item_id'), ServiceItem.item_name,
+                       ServiceItem.part_number, ServiceItem.quantity, ServiceItem.price,
+                       ServiceItem.labour.label('item_labour'))
+             .outerjoin(Vehicle, ServiceVisit.vehicle_id == Vehicle.id)
+             .outerjoin(Customer, Vehicle.customer_id == Customer.id)
+             .outerjoin(ServiceItem, ServiceItem.visit_id == ServiceVisit.id))
+    if filters['date_from']:
+        query = query.where(ServiceVisit.date >= filters['date_from'])
+    if filters['date_to']:
+        query = query.where(ServiceVisit.date < filters['date_to'])
+    if filters['category']:
+        query = query.where(ServiceVisit.visit_category == filters['category'])
+    if filters['customer_id']:
+        query = query.where(Vehicle.customer_id == filters['customer_id'])
+    query = (query.order_by(ServiceVisit.date, ServiceVisit.id, ServiceItem.id)
+             .execution_options(yield_per=app.config['EXPORT_BATCH_SIZE']))
+    for row in db.session.execute(query):
+        yield row._mapping
+
+@app.route('/exports/visits.<fmt>')
+@login_required
+@database.read_only
+def export_visits(fmt):
+    if fmt not in exporter.FORMATS:
+        abort(404)
+    try:
+        filters = parse_export_filters(request.args)
+    except ValueError as exc:
+        return jsonify(error=str(exc)), 400
+    filename = f"visits_{datetime.now().strftime('%Y%m%d_%H%M')}.{fmt}"
+    return Response(
+        stream_with_context(exporter.chunks(fmt, iter_export_rows(filters))),
+        mimetype=exporter.FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename={filename}'},
+    )
+
+@app.cli.command('export-visits')
+@click.option('--from', 'date_from', help='First visit date to include (YYYY-MM-DD).')
+@click.option('--to', 'date_to', help='Last visit date to include (YYYY-MM-DD).')
+@click.option('--category', help='Only visits of this category.')
+@click.option('--customer', 'customer_id', type=int, help='Only visits of this customer\'s vehicles.')
+@click.option('--format', 'fmt', type=click.Choice(list(exporter.FORMATS)), default='csv')
+@click.option('--output', '-o', default='-', type=click.Path(dir_okay=False, allow_dash=True))
+def export_visits_command(date_from, date_to, category, customer_id, fmt, output):
+    """Export service visits and their items as CSV or JSON."""
+    try:
+        filters = parse_export_filters({
+            'date_from': date_from, 'date_to': date_to, 'category': category, 'customer_id': customer_id
+        })
+    except ValueError as exc:
+        raise click.UsageError(str(exc))
+    database.use_replica()
+    out = click.get_text_stream('stdout') if output == '-' else open(output, 'w', encoding='utf-8', newline='')
+    try:
+        for chunk in exporter.chunks(fmt, iter_export_rows(filters)):
+            out.write(chunk)
+    finally:
+        if out is not click.get_text_stream('stdout'):
+            out.close()
+
+def report_cache_key(v, parts=None, full_history=False):
+    """Cache key of a vehicle report: changes whenever its content could change."""
+    if parts is None:
+        parts, _ = vehicle_state(v)
+    _, _, visit_count, last_visit_id, *_ = parts
+    if full_history:
+        # Archiving also removes the visits from the main database, so the count tracks the archived part
+        visit_count = f'{visit_count}-full{visit_archive.count(v.id)}'
+    header = repr((v.name, v.plate, v.model, v.vin_number, v.type, v.status, v.date_booked, v.technician) + parts)
+    digest = hashlib.sha1(header.encode()).hexdigest()[:12]
+    # The kind is the ReportCache group, so each variant only replaces older files of the same variant
+    kind = 'vehicle_full' if full_history else 'vehicle'
+    return f'{kind}-{v.id}-{last_visit_id or 0}-{visit_count}-{digest}.pdf'
+
+def report_filename(v):
+    return f'vehicle_{v.plate}_report.pdf'
+
+def render_report_to(vehicle_id, full_history=False):
+    """Return a render(path) callable that draws the report in its own app context."""
+    def render(path, progress=None):
+        with app.app_context():
+            database.use_replica()
+            v = Vehicle.query.options(joinedload(Vehicle.customer)).get(vehicle_id)
+            visits = iter_visit_history(vehicle_id, full_history=full_history)
+            reports.render_vehicle_report(path, v, visits, report_assets)
+    return render
+
+def send_report(path, v):
+    return send_file(path, as_attachment=True, download_name=report_filename(v), mimetype='application/pdf',
+                     etag=False)
+
 @app.route('/vehicles/<int:vehicle_id>/report')
 @login_required
+@database.read_only
 def vehicle_report(vehicle_id):
-    from flask import send_file, current_app
-    import io
-    from reportlab.lib.pagesizes import letter
-    from reportlab.pdfgen import canvas
-    from reportlab.lib.utils import ImageReader
-    import os
+    v = Vehicle.query.options(joinedload(Vehicle.customer)).get_or_404(vehicle_id)
+    parts, last_modified = vehicle_state(v)
+    full_history = request.args.get('full_history') == '1'
+    key = report_cache_key(v, parts, full_history)
+    etag = key.rsplit('.', 1)[0]  # the key already identifies the report's content
+    cached = not_modified(etag, last_modified)
+    if cached:
+        return cached
+    path = report_cache.get(key)
+    if path is None:
+        # The PDF is written straight to the cache file and streamed from disk
+        visits = iter_visit_history(vehicle_id, full_history=full_history)
+        path = report_cache.render(key, lambda out: reports.render_vehicle_report(out, v, visits, report_assets))
+    return with_validators(send_report(path, v), etag, last_modified)
 
-    v = Vehicle.query.get_or_404(vehicle_id)
-    visits = ServiceVisit.query.filter_by(vehicle_id=vehicle_id).order_by(ServiceVisit.date.desc()).all()
-    buffer = io.BytesIO()
-    p = canvas.Canvas(buffer, pagesize=letter)
-    width, height = letter
-    y = height - 40
-
-    # Company logo and details
-    logo_path = os.path.join(current_app.root_path, 'static', 'powertune.jpg')
-    logo_height = 50
-    logo_width = 100
-    logo_y = y - logo_height + 10
-    if os.path.exists(logo_path):
-        p.drawImage(ImageReader(logo_path), 40, logo_y, width=logo_width, height=logo_height, mask='auto')
-    p.setFont('Helvetica-Bold', 18)
-    p.drawString(160, y-20, "POWERTUNE AUTO GARAGE")
-    p.setFont('Helvetica', 10)
-    p.drawString(160, y-38, "Nairobi, Kenya | Tel: 0748 638225 | Email: info@powertune.co.ke")
-    y -= 70
-
-    # Vehicle and customer details
-    p.setFont('Helvetica-Bold', 15)
-    p.drawString(40, y, f"Vehicle Comprehensive Report")
-    y -= 20
-    p.setFont('Helvetica', 12)
-    p.drawString(40, y, f"Vehicle: {v.name} ({v.plate})")
-    y -= 16
-    p.drawString(40, y, f"Model: {v.model}")
-    y -= 16
-    p.drawString(40, y, f"VIN: {v.vin_number or '-'}")
-    y -= 16
-    p.drawString(40, y, f"Visit Category: {v.type or '-'}")
-    y -= 16
-    p.drawString(40, y, f"Status: {v.status}")
-    y -= 16
-    p.drawString(40, y, f"Date Booked: {v.date_booked or '-'}")
-    y -= 16
-    p.drawString(40, y, f"Technician: {v.technician or '-'}")
-    y -= 28
-
-    if v.customer:
-        p.drawString(40, y, "Customer Details:")
-        y -= 14
-        p.setFont('Helvetica', 11)
-        p.drawString(60, y, f"Name: {v.customer.name}")
-        y -= 14
-        p.drawString(60, y, f"Phone: {v.customer.phone}")
-        y -= 14
-        p.drawString(60, y, f"Email: {v.customer.email}")
-        y -= 16
-        p.setFont('Helvetica', 12)
-    y -= 10
-
-    # Service Visits
-    p.setFont('Helvetica-Bold', 13)
-    p.drawString(40, y, "Visit & Service History:")
-    y -= 18
-    p.setFont('Helvetica', 11)
-    if not visits:
-        p.drawString(40, y, "No service visits found.")
+@app.route('/vehicles/<int:vehicle_id>/report/jobs', methods=['POST'])
+@login_required
+def queue_vehicle_report(vehicle_id):
+    v = Vehicle.query.options(joinedload(Vehicle.customer)).get_or_404(vehicle_id)
+    full_history = request.values.get('full_history') == '1'
+    meta = {'vehicle_id': vehicle_id, 'filename': report_filename(v)}
+    job = report_jobs.submit(report_cache_key(v, full_history=full_history),
+                             render_report_to(vehicle_id, full_history), meta=meta)
+    return report_job_response(job), 202
+
+# Fleet reports: many vehicles rendered on a process pool into one ZIP or PDF
+
+def parse_fleet_selection(values):
+    """Vehicle selection of a fleet report from request/CLI values; raises ValueError."""
+    selection = {'customer_id': None, 'plates': [], 'date_from': None, 'date_to': None}
+    if values.get('customer_id'):
+        selection['customer_id'] = int(values['customer_id'])
+    plates = values.getlist('plate') if hasattr(values, 'getlist') else values.get('plate') or []
+    plates += (values.get('plates') or '').split(',')
+    selection['plates'] = [p.strip() for p in plates if p and p.strip()]
+    for field in ('date_from', 'date_to'):
+        if values.get(field):
+            selection[field] = datetime.strptime(values[field], '%Y-%m-%d')
+    if not (selection['customer_id'] or selection['plates'] or selection['date_from'] or selection['date_to']):
+        raise ValueError('Select vehicles by customer_id, plates or a date range.')
+    if selection['date_to']:
+        selection['date_to'] += timedelta(days=1)  # inclusive end date
+    return selection
+
+def fleet_vehicle_ids(selection):
+    query = db.session.query(Vehicle.id)
+    if selection['customer_id']:
+        query = query.filter(Vehicle.customer_id == selection['customer_id'])
+    if selection['plates']:
+        query = query.filter(Vehicle.plate.in_(selection['plates']))
+    if selection['date_from'] or selection['date_to']:
+        visits = db.session.query(ServiceVisit.vehicle_id)
+        if selection['date_from']:
+            visits = visits.filter(ServiceVisit.date >= selection['date_from'])
+        if selection['date_to']:
+            visits = visits.filter(ServiceVisit.date < selection['date_to'])
+        query = query.filter(Vehicle.id.in_(visits))
+    return [vehicle_id for (vehicle_id,) in query.order_by(Vehicle.id)]
+
+def render_fleet_report_to(vehicle_ids, selection, fmt):
+    """Return a render(path, progress) callable producing the fleet report."""
+    ranged = selection['date_from'] or selection['date_to']
+
+    def history(vehicle_id):
+        return iter_visit_history(vehicle_id, date_from=selection['date_from'], date_to=selection['date_to'])
+
+    def vehicles():
+        for vehicle_id in vehicle_ids:
+            v = Vehicle.query.options(joinedload(Vehicle.customer)).get(vehicle_id)
+            if v is not None:
+                yield v
+
+    def zip_entries():
+        for v in vehicles():
+            name = f'{secure_filename(v.plate) or v.id}.pdf'
+            # Full-history reports already in the per-vehicle cache are reused as-is
+            cached = None if ranged else report_cache.get(report_cache_key(v))
+            yield name, cached or reports.snapshot(v, history(v.id))
+
+    def render(path, progress=None):
+        with app.app_context():
+            database.use_replica()
+            if fmt == 'pdf':
+                # One canvas in this thread; only ZIP output uses the process pool (see render_fleet_pdf)
+                reports.render_fleet_pdf(path, ((v, history(v.id)) for v in vehicles()), report_assets, progress)
+            else:
+                reports.render_fleet_zip(path, zip_entries(), app.config['FLEET_REPORT_PROCESSES'],
+                                         report_assets.logo_path, progress)
+    return render
+
+@app.route('/fleet-reports', methods=['POST'])
+@login_required
+def queue_fleet_report():
+    fmt = request.values.get('format', 'zip')
+    if fmt not in ('zip', 'pdf'):
+        return jsonify(error='format must be zip or pdf'), 400
+    try:
+        selection = parse_fleet_selection(request.values)
+    except ValueError as exc:
+        return jsonify(error=str(exc)), 400
+    vehicle_ids = fleet_vehicle_ids(selection)
+    if not vehicle_ids:
+        return jsonify(error='No vehicles match the selection.'), 404
+    if len(vehicle_ids) > app.config['FLEET_REPORT_MAX_VEHICLES']:
+        return jsonify(error=f"At most {app.config['FLEET_REPORT_MAX_VEHICLES']} vehicles per fleet report."), 400
+    fleet_cache.purge(reports.ReportJobQueue.JOB_TTL)
+    key = f'fleet-{uuid.uuid4().hex}.{fmt}'
+    meta = {'vehicles': len(vehicle_ids), 'filename': f"fleet_report_{datetime.now().strftime('%Y%m%d_%H%M')}.{fmt}"}
+    job = fleet_jobs.submit(key, render_fleet_report_to(vehicle_ids, selection, fmt), meta=meta)
+    return report_job_response(job), 202
+
+@app.cli.command('fleet-report')
+@click.option('--customer', 'customer_id', type=int, help='Report every vehicle of this customer.')
+@click.option('--plate', 'plates', multiple=True, help='Vehicle plate; may be repeated.')
+@click.option('--from', 'date_from', help='First visit date to include (YYYY-MM-DD).')
+@click.option('--to', 'date_to', help='Last visit date to include (YYYY-MM-DD).')
+@click.option('--format', 'fmt', type=click.Choice(['zip', 'pdf']), default='zip')
+@click.option('--output', '-o', required=True, type=click.Path(dir_okay=False))
+def fleet_report_command(customer_id, plates, date_from, date_to, fmt, output):
+    """Render the reports of many vehicles into one ZIP or PDF file."""
+    try:
+        selection = parse_fleet_selection({
+            'customer_id': customer_id, 'plate': list(plates), 'date_from': date_from, 'date_to': date_to
+        })
+    except ValueError as exc:
+        raise click.UsageError(str(exc))
+    vehicle_ids = fleet_vehicle_ids(selection)
+    if not vehicle_ids:
+        raise click.ClickException('No vehicles match the selection.')
+    total = len(vehicle_ids)
+    render = render_fleet_report_to(vehicle_ids, selection, fmt)
+    render(output, lambda done: click.echo(f'\r{done}/{total} vehicles', nl=False, err=True))
+    click.echo(f'\nWrote {output}', err=True)
+
+@app.cli.command('db-info')
+def db_info_command():
+    """Show the database URL, pool options and effective SQLite pragmas."""
+    click.echo(f'url: {db.engine.url.render_as_string(hide_password=True)}')
+    for name, value in app.config['SQLALCHEMY_ENGINE_OPTIONS'].items():
+        click.echo(f'{name}: {value}')
+    if db.engine.dialect.name == 'sqlite':
+        with db.engine.connect() as conn:
+            for name, value in database.current_pragmas(conn).items():
+                click.echo(f'pragma {name}: {value}')
+
+# Instrumentation: Prometheus scrape endpoint and admin debug panel (see metrics.py)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    token = app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        abort(401)
+    return Response(request_metrics.prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/debug/performance')
+@login_required
+@role_required('admin', 'Only admin can view performance data.')
+def debug_performance():
+    return render_template('debug_performance.html', routes=request_metrics.summary(),
+                           slow_queries=list(request_metrics.slow_queries),
+                           slow_query_ms=request_metrics.slow_query_ms, fragments=fragment_cache,
+                           since=datetime.fromtimestamp(request_metrics.started))
+
+# Analytics over columnar snapshots of the service history (see analytics.py). The module
+# pulls in numpy, so it is imported on first use rather than when the app boots.
+
+_analytics = {'snapshot': None, 'stamp': None}
+_analytics_building = threading.Lock()
+
+def refresh_analytics_snapshot():
+    """Rebuild the analytics snapshot, reading from the replica when there is one."""
+    import analytics
+    engine = db.engines[database.REPLICA] if database.REPLICA in db.engines else db.engine
+    return analytics.build_snapshot(engine, db.metadata.tables, app.config['ANALYTICS_DIR'])
+
+def _rebuild_analytics_in_background():
+    if not _analytics_building.acquire(blocking=False):
+        return  # already running in this process
+    def run():
+        try:
+            with app.app_context():
+                refresh_analytics_snapshot()
+        except Exception:
+            app.logger.exception('Rebuilding the analytics snapshot failed')
+        finally:
+            _analytics_building.release()
+    threading.Thread(target=run, name='analytics-snapshot', daemon=True).start()
+
+def analytics_snapshot():
+    """The current snapshot, or None while the first one is built; stale ones are rebuilt in the background."""
+    import analytics
+    directory = app.config['ANALYTICS_DIR']
+    stamp = analytics.Snapshot.stamp(directory)
+    if stamp is None:
+        _rebuild_analytics_in_background()
+        return None
+    if _analytics['stamp'] != stamp:
+        _analytics.update(snapshot=analytics.Snapshot(directory), stamp=stamp)
+    if time.time() - _analytics['snapshot'].built_at > app.config['ANALYTICS_MAX_AGE']:
+        _rebuild_analytics_in_background()
+    return _analytics['snapshot']
+
+def cents(value):
+    return str(Decimal(value).scaleb(-2))
+
+def analytics_summary(snapshot, args):
+    weeks = max(2, min(args.get('weeks', 12, type=int), 104))
+    window = max(1, min(args.get('window', 4, type=int), weeks))
+    days = max(1, min(args.get('days', 365, type=int), 3660))
+    date_from = snapshot.last_day() - timedelta(days=days - 1)
+    week_starts, forecast = snapshot.demand_forecast(weeks, window)
+    return {
+        'built_at': datetime.fromtimestamp(snapshot.built_at).isoformat(timespec='seconds'),
+        'visits': len(snapshot.day), 'items': len(snapshot.part),
+        'weeks': [start.isoformat() for start in week_starts], 'window': window, 'forecast': forecast,
+        'days': days,
+        'revenue_by_category': [{'category': label, 'revenue': cents(total), 'visits': n}
+                                for label, total, n in snapshot.revenue_by('category', date_from)],
+        'revenue_by_make': [{'make': label, 'revenue': cents(total), 'visits': n}
+                            for label, total, n in snapshot.revenue_by('make', date_from)],
+    }
+
+@app.route('/analytics')
+@login_required
+@role_required('admin', 'Only admin can view analytics.')
+def analytics_page():
+    import analytics
+    if not analytics.available():
+        flash('Analytics requires the numpy package.', 'warning')
+        return redirect(url_for('dashboard'))
+    snapshot = analytics_snapshot()
+    return render_template('analytics.html', summary=snapshot and analytics_summary(snapshot, request.args))
+
+@app.route('/analytics/summary')
+@login_required
+@role_required('admin', 'Only admin can view analytics.')
+def analytics_summary_json():
+    import analytics
+    if not analytics.available():
+        return jsonify(error='Analytics requires the numpy package.'), 503
+    snapshot = analytics_snapshot()
+    if snapshot is None:
+        return jsonify(error='The analytics snapshot is being built.'), 503, {'Retry-After': '30'}
+    return jsonify(analytics_summary(snapshot, request.args))
+
+@app.cli.command('analytics-snapshot')
+def analytics_snapshot_command():
+    """Rebuild the analytics snapshot (run from cron to keep it fresh)."""
+    started = time.perf_counter()
+    counts = refresh_analytics_snapshot()
+    click.echo(f"Snapshot of {counts['visits']} visits and {counts['items']} items "
+               f"written in {time.perf_counter() - started:.1f}s.")
+
+# Cold storage: old visits move to a compressed archive database (see archive.py)
+
+def archived_visit(visit_id):
+    visit = visit_archive.get(visit_id)
+    if visit is not None:
+        visit.vehicle = Vehicle.query.options(joinedload(Vehicle.customer)).filter_by(id=visit.vehicle_id).first()
+    return visit
+
+@app.cli.command('archive-visits')
+@click.option('--older-than-days', type=int, help='Archive visits older than this (default ARCHIVE_AFTER_DAYS).')
+@click.option('--batch-size', type=int, help='Visits moved per transaction.')
+@click.option('--vacuum', is_flag=True, help='Compact the main database afterwards; blocks writers while it runs.')
+def archive_visits_command(older_than_days, batch_size, vacuum):
+    """Move old visits and their items to the archive database (safe to run from cron while serving)."""
+    days = app.config['ARCHIVE_AFTER_DAYS'] if older_than_days is None else older_than_days
+    before = datetime.utcnow() - timedelta(days=days)
+    moved = archive.archive_visits(
+        db.engine, db.metadata.tables, visit_archive, before, batch_size or app.config['ARCHIVE_BATCH_SIZE'],
+        progress=lambda n, elapsed: click.echo(f'\rarchived {n} visits in {elapsed:.1f}s', nl=False),
+    )
+    click.echo()
+    forgotten = archive.forget_deleted_vehicles(db.engine, db.metadata.tables, visit_archive)
+    if forgotten:
+        click.echo(f'Dropped {forgotten} archived visits of deleted vehicles.')
+    if moved and vacuum:
+        started = time.perf_counter()
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.exec_driver_sql('VACUUM')
+            if db.engine.dialect.name == 'sqlite':
+                conn.exec_driver_sql('PRAGMA wal_checkpoint(TRUNCATE)')  # VACUUM rewrites the whole file into the WAL
+        click.echo(f'Main database compacted in {time.perf_counter() - started:.1f}s.')
+    count, size = visit_archive.stats()
+    click.echo(f'Moved {moved} visits older than {before:%Y-%m-%d}; '
+               f'the archive holds {count} visits in {size / 1024 / 1024:.1f} MB.')
+
+def find_report_job(job_id):
+    return report_jobs.get(job_id) or fleet_jobs.get(job_id)
+
+@app.route('/reports/jobs/<job_id>')
+@login_required
+def report_job_status(job_id):
+    job = find_report_job(job_id)
+    if job is None:
+        abort(404)
+    return report_job_response(job)
+
+@app.route('/reports/jobs/<job_id>/download')
+@login_required
+def download_report_job(job_id):
+    job = find_report_job(job_id)
+    if job is None:
+        abort(404)
+    if job.status != 'done':
+        return report_job_response(job), 409
+    if not os.path.exists(job.path):
+        abort(404)  # superseded by a newer report of the same vehicle
+    return send_file(job.path, as_attachment=True, download_name=job.meta['filename'])
+
+def report_job_response(job):
+    data = job.to_dict()
+    data['status_url'] = url_for('report_job_status', job_id=job.id)
+    data['download_url'] = url_for('download_report_job', job_id=job.id) if job.status == 'done' else None
+    return jsonify(data)
+
+# Parts catalogue: every service item points at a Part; add_visit autocompletes from part_index
+
+PART_STATS_SQL = """
+    UPDATE part SET
+        usage_count = (SELECT count(*) FROM service_item WHERE service_item.part_id = part.id),
+        last_price = (SELECT price FROM service_item WHERE service_item.part_id = part.id ORDER BY id DESC LIMIT 1)
+"""
+
+def link_parts(items):
+    """Point new `items` at their catalogue parts, adding missing parts and counting the use."""
+    keys = [part_key(item.item_name, item.part_number) for item in items]
+    if not keys:
+        return
+    rows = {}
+    for item, key in zip(items, keys):
+        rows.setdefault(key, {'lookup_key': key, 'name': item.item_name, 'part_number': item.part_number})
+    known = {key for (key,) in db.session.query(Part.lookup_key).filter(Part.lookup_key.in_(rows))}
+    missing = [row for key, row in rows.items() if key not in known]
+    if missing:
+        # Another visit may add the same part meanwhile; its row wins instead of failing the unique key
+        db.session.execute(text("""
+            INSERT INTO part (lookup_key, name, part_number, usage_count)
+            VALUES (:lookup_key, :name, :part_number, 0)
+            ON CONFLICT (lookup_key) DO NOTHING
+        """), missing)
+    parts = {part.lookup_key: part for part in Part.query.filter(Part.lookup_key.in_(rows))}
+    counts = {}
+    for item, key in zip(items, keys):
+        part = parts[key]
+        item.part = part
+        part.last_price = item.price
+        counts[key] = counts.get(key, 0) + 1
+    for key, count in counts.items():
+        # Incremented in SQL so concurrent visits do not lose counts
+        parts[key].usage_count = Part.usage_count + count
+
+def link_unlinked_items(recount=False):
+    """Catalogue items written without a part (bulk imports, generated data); returns how many were linked."""
+    with db.engine.begin() as conn:
+        conn.execute(text(f"""
+            INSERT INTO part (lookup_key, name, part_number, usage_count)
+            SELECT {PART_KEY_SQL}, min(item_name), min(part_number), 0 FROM service_item
+            WHERE part_id IS NULL AND {PART_KEY_SQL} NOT IN (SELECT lookup_key FROM part)
+            GROUP BY {PART_KEY_SQL}
+        """))
+        linked = conn.execute(text(f"""
+            UPDATE service_item SET part_id = (SELECT part.id FROM part WHERE part.lookup_key = {PART_KEY_SQL})
+            WHERE part_id IS NULL
+        """)).rowcount
+        if linked or recount:
+            conn.execute(text(PART_STATS_SQL))
+    part_index.invalidate()
+    return linked
+
+@app.cli.command('link-parts')
+def link_parts_command():
+    """Add unlinked service items to the parts catalogue and recount part usage."""
+    click.echo(f'Linked {link_unlinked_items(recount=True)} items to catalogue parts.')
+
+def refresh_part_index():
+    columns = (Part.id, Part.usage_count, Part.name, Part.part_number)
+    if part_index.is_stale():
+        part_index.rebuild(db.session.query(*columns))
     else:
-        for idx, visit in enumerate(visits, 1):
-            if y < 100:
-                p.showPage()
-                y = height - 40
-            p.setFont('Helvetica-Bold', 11)
-            p.drawString(50, y, f"{idx}. Date: {visit.date.strftime('%Y-%m-%d %H:%M')} | Category: {visit.visit_category or '-'} | Notes: {visit.notes or '-'}")
-            y -= 14
-            p.setFont('Helvetica', 11)
-            items = visit.items
-            parts_total = sum(item.quantity * item.price for item in items)
-            items_labour_total = sum(item.labour or 0 for item in items)
-            visit_labour = visit.labour or 0
-            grand_total = parts_total + items_labour_total + visit_labour
-            if items:
-                p.drawString(70, y, "Items:")
-                y -= 14
-                for item in items:
-                    p.drawString(80, y, f"- {item.item_name} | Part#: {item.part_number or '-'} | Qty: {item.quantity} | Price: {item.price} | Labour: {item.labour or 0}")
-                    y -= 12
-            p.drawString(80, y, f"Parts Total: {parts_total} | Labour (Items): {items_labour_total} | Labour (Visit): {visit_labour} | Grand Total: {grand_total}")
-            y -= 18
-
-    p.setFont('Helvetica-Oblique', 9)
-    p.drawString(40, 30, "Generated by Powertune Garage System - {date}".format(date=datetime.now().strftime('%Y-%m-%d %H:%M')))
-    p.save()
-    buffer.seek(0)
-    return send_file(buffer, as_attachment=True, download_name=f'vehicle_{v.plate}_report.pdf', mimetype='application/pdf')
+        for row in db.session.query(*columns).filter(Part.id > part_index.max_id):
+            part_index.update(*row)
+
+@app.route('/parts/search')
+@login_required
+@database.read_only
+def part_search():
+    limit = max(1, min(request.args.get('limit', TYPEAHEAD_LIMIT, type=int), MAX_TYPEAHEAD_LIMIT))
+    refresh_part_index()
+    ids = part_index.search(request.args.get('q', ''), limit)
+    found = {p.id: p for p in Part.query.filter(Part.id.in_(ids))} if ids else {}
+    return jsonify(results=[
+        {'id': p.id, 'name': p.name, 'part_number': p.part_number, 'usage_count': p.usage_count,
+         'last_price': p.last_price}
+        for p in map(found.get, ids) if p
+    ])
+
+@event.listens_for(SASession, 'after_flush')
+def _track_part_usage(session, flush_context):
+    for obj in session.new:
+        if isinstance(obj, ServiceItem) and obj.part is not None:
+            usage = session.info.setdefault('part_usage', {})
+            count = usage[obj.part.id][0] if obj.part.id in usage else 0
+            usage[obj.part.id] = (count + 1, obj.part.name, obj.part.part_number)
+
+@event.listens_for(SASession, 'after_commit')
+def _update_part_index(session):
+    usage = session.info.pop('part_usage', {})
+    if part_index.built is None:
+        return
+    for part_id, (count, name, part_number) in usage.items():
+        part_index.add_usage(part_id, count, name, part_number)
+
+@event.listens_for(SASession, 'after_rollback')
+def _forget_part_usage(session):
+    session.info.pop('part_usage', None)
 
 @app.route('/vehicles/<int:vehicle_id>/add_visit', methods=['GET', 'POST'])
 @login_required
@@ -410,19 +1651,19 @@ def add_visit(vehicle_id):
         labours = request.form.getlist('labour')
         visit_labour = float(request.form.get('visit_labour', 0))
         visit = ServiceVisit(vehicle_id=vehicle_id, notes=notes, visit_category=visit_category, labour=visit_labour)
-        db.session.add(visit)
-        db.session.flush()
         for name, part_no, qty, price, labour in zip(item_names, part_numbers, quantities, prices, labours):
             if name.strip():
-                item = ServiceItem(
-                    visit_id=visit.id,
+                visit.items.append(ServiceItem(
                     item_name=name.strip(),
                     part_number=part_no.strip() if part_no else None,
                     quantity=int(qty) if qty else 1,
                     price=float(price) if price else 0.0,
                     labour=float(labour) if labour else 0.0
-                )
-                db.session.add(item)
+                ))
+        link_parts(visit.items)
+        # Totals are written in the same transaction as the items they summarize
+        visit.update_totals()
+        db.session.add(visit)
         db.session.commit()
         flash('Service visit added!', 'success')
         return redirect(url_for('vehicle_detail', vehicle_id=vehicle_id))
@@ -430,29 +1671,33 @@ def add_visit(vehicle_id):
 
 @app.route('/visit/<int:visit_id>/print')
 @login_required
+@database.read_only
 def print_visit(visit_id):
-    visit = ServiceVisit.query.get_or_404(visit_id)
-    vehicle = Vehicle.query.get_or_404(visit.vehicle_id)
+    visit = ServiceVisit.query.options(
+        joinedload(ServiceVisit.vehicle).joinedload(Vehicle.customer)
+    ).filter_by(id=visit_id).first() or archived_visit(visit_id)
+    if visit is None or visit.vehicle is None:
+        abort(404)
+    vehicle = visit.vehicle
     customer = vehicle.customer
-    items = visit.items
-
-    # Calculate totals
-    parts_total = sum(item.quantity * item.price for item in items)
-    items_labour_total = sum(item.labour or 0 for item in items)
-    visit_labour = visit.labour or 0
-    grand_total = parts_total + items_labour_total + visit_labour
+    etag = page_etag('print_visit', visit.id, visit.version, vehicle.version, customer_digest(customer))
+    last_modified = max(visit.updated_at, vehicle.updated_at)
+    cached = not_modified(etag, last_modified)
+    if cached:
+        return cached
 
-    return render_template(
+    response = app.make_response(render_template(
         'print_visit.html',
         visit=visit,
         vehicle=vehicle,
         customer=customer,
-        items=items,
-        parts_total=parts_total,
-        items_labour_total=items_labour_total,
-        visit_labour=visit_labour,
-        grand_total=grand_total
-    )
+        items=visit.items,
+        parts_total=visit.parts_total,
+        items_labour_total=visit.items_labour_total,
+        visit_labour=to_money(visit.labour),
+        grand_total=visit.grand_total
+    ))
+    return with_validators(response, etag, last_modified)
 
 @app.route('/change_password', methods=['GET', 'POST'])
 @login_required
@@ -461,7 +1706,7 @@ def change_password():
         current_password = request.form['current_password']
         new_password = request.form['new_password']
         confirm_password = request.form['confirm_password']
-        user = User.query.filter_by(username=session.get('username')).first()
+        user = current_user()
         if not user or not check_password_hash(user.password_hash, current_password):
             flash('Current password is incorrect.', 'danger')
         elif new_password != confirm_password:
@@ -475,12 +1720,8 @@ def change_password():
 
 @app.route('/users/add', methods=['GET', 'POST'])
 @login_required
+@role_required('admin', 'Only admin can add users.')
 def add_user():
-    # Only allow admin
-    user = User.query.get(session['user_id'])
-    if user.role != 'admin':
-        flash('Only admin can add users.', 'danger')
-        return redirect(url_for('dashboard'))
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
@@ -496,7 +1737,19 @@ def add_user():
             return redirect(url_for('dashboard'))
     return render_template('add_user.html')
 
+# Serving entry point used by wsgi.py. This is not an application factory: the
+# views above are registered on the module's app at import, and the database,
+# caches and page salt are set up then from the environment, so there is one
+# application per process. serving_app() only does the warm-up a serving
+# process wants but CLI commands and scripts do not.
+
+def serving_app():
+    """The module's application, warmed up for serving requests."""
+    if app.config['PRELOAD_REPORT_ASSETS']:
+        # With gunicorn's preload_app this runs once in the master and is shared by every forked worker
+        report_assets.warm()
+    return app
+
 if __name__ == '__main__':
-    create_admin()
-    # Set debug=False for production. Set to True only for local testing.
-    app.run(debug=False, port=5001)
+    # Development server only; see wsgi.py for production serving
+    serving_app().run(debug=False, port=5001)
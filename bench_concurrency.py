@@ -0,0 +1,143 @@
+"""Concurrent read/write load test for the SQLite engine settings.
+
+Usage: python bench_concurrency.py [readers] [writers] [seconds]
+
+Builds a throwaway SQLite database from the app's models, then runs reader
+threads (visit history of a random vehicle) and writer threads (a visit with
+three items per transaction) against it at the same time, once with SQLite's
+defaults and once with the pragmas from database.SQLITE_PRAGMAS. Prints the
+throughput, p50/p95 latency and number of "database is locked" errors of
+each. The application database is not touched.
+"""
+from app import db
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from datetime import datetime
+import database
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+VEHICLES = 500
+VISITS_PER_VEHICLE = 5
+
+READ_SQL = text('SELECT * FROM service_visit WHERE vehicle_id = :vehicle_id ORDER BY date DESC')
+VISIT_SQL = text('INSERT INTO service_visit (vehicle_id, date, visit_category, labour, parts_total, '
+                 'items_labour_total, grand_total) VALUES (:vehicle_id, :date, :category, 0, 3000, 0, 3000)')
+ITEM_SQL = text('INSERT INTO service_item (visit_id, item_name, quantity, price, labour) '
+                'VALUES (:visit_id, :name, 1, 10, 0)')
+
+
+def populate(engine):
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            'INSERT INTO vehicle (id, name, model, plate, status) VALUES (?, ?, ?, ?, ?)',
+            [(i, 'Toyota', 'Corolla', f'K{i:07d}', 'Active') for i in range(1, VEHICLES + 1)]
+        )
+        conn.exec_driver_sql(
+            'INSERT INTO service_visit (vehicle_id, date, visit_category, labour) VALUES (?, ?, ?, ?)',
+            [(v, datetime(2024, 1, 1 + n), 'Service', 0) for v in range(1, VEHICLES + 1)
+             for n in range(VISITS_PER_VEHICLE)]
+        )
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {'read': [], 'write': []}
+        self.locked = {'read': 0, 'write': 0}
+
+    def record(self, kind, seconds):
+        with self.lock:
+            self.latencies[kind].append(seconds)
+
+    def failed(self, kind):
+        with self.lock:
+            self.locked[kind] += 1
+
+
+def reader(engine, stats, stop, seed):
+    rng = random.Random(seed)
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            with engine.connect() as conn:
+                conn.execute(READ_SQL, {'vehicle_id': rng.randint(1, VEHICLES)}).fetchall()
+        except OperationalError:
+            stats.failed('read')
+            continue
+        stats.record('read', time.perf_counter() - started)
+
+
+def writer(engine, stats, stop, seed):
+    rng = random.Random(seed)
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            with engine.begin() as conn:
+                visit_id = conn.execute(VISIT_SQL, {
+                    'vehicle_id': rng.randint(1, VEHICLES), 'date': datetime.utcnow(), 'category': 'Service'
+                }).lastrowid
+                conn.execute(ITEM_SQL, [{'visit_id': visit_id, 'name': f'Part {n}'} for n in range(3)])
+        except OperationalError:
+            stats.failed('write')
+            continue
+        stats.record('write', time.perf_counter() - started)
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run(label, pragmas, readers, writers, seconds):
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    url = f'sqlite:///{path}'
+    # pysqlite waits up to `timeout` seconds for a lock by default; keep that for the baseline
+    engine = create_engine(url, pool_size=readers + writers, **database.engine_options(url))
+    database.install_pragmas(engine, pragmas)
+    try:
+        populate(engine)
+        stats, stop = Stats(), threading.Event()
+        threads = [threading.Thread(target=reader, args=(engine, stats, stop, n)) for n in range(readers)]
+        threads += [threading.Thread(target=writer, args=(engine, stats, stop, 1000 + n)) for n in range(writers)]
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        with engine.connect() as conn:
+            mode = conn.exec_driver_sql('PRAGMA journal_mode').scalar()
+        print(f'\n== {label} (journal_mode={mode}) ==')
+        for kind in ('read', 'write'):
+            latencies = stats.latencies[kind]
+            print(f'{kind:5} {len(latencies) / seconds:9.1f} ops/s  '
+                  f'p50 {percentile(latencies, 0.50) * 1000:8.2f} ms  '
+                  f'p95 {percentile(latencies, 0.95) * 1000:8.2f} ms  '
+                  f'locked errors {stats.locked[kind]}')
+    finally:
+        engine.dispose()
+        for suffix in ('', '-wal', '-shm', '-journal'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+def main():
+    readers = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    writers = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 5
+    print(f'{readers} readers, {writers} writers, {seconds:g} s per run')
+    run('SQLite defaults', {}, readers, writers, seconds)
+    run('tuned pragmas', database.sqlite_pragmas(), readers, writers, seconds)
+
+
+if __name__ == "__main__":
+    main()
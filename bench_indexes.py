@@ -0,0 +1,125 @@
+"""Benchmark the detail-page lookups with and without the lookup indexes.
+
+Usage: python bench_indexes.py [vehicles] [visits_per_vehicle]
+
+Builds a throwaway SQLite database from the app's models, fills it with
+synthetic customers, vehicles, visits and items, then prints the query plan
+and mean latency of each lookup before and after the model indexes exist.
+The application database is not touched.
+"""
+from app import db
+from sqlalchemy import create_engine, text
+from datetime import datetime, timedelta
+import os
+import random
+import sys
+import tempfile
+import time
+
+ITEMS_PER_VISIT = 3
+CUSTOMERS_PER_VEHICLE = 0.5
+REPEAT = 200
+
+QUERIES = [
+    ('visit history', 'SELECT * FROM service_visit WHERE vehicle_id = :vehicle_id ORDER BY date DESC'),
+    ('visit items', 'SELECT * FROM service_item WHERE visit_id IN (:visit_id, :visit_id + 1, :visit_id + 2)'),
+    ('customer vehicles', 'SELECT * FROM vehicle WHERE customer_id = :customer_id'),
+    ('vehicle timeline', 'SELECT * FROM vehicle_history WHERE vehicle_id = :vehicle_id ORDER BY id DESC LIMIT 25'),
+    ('visits in a day', 'SELECT count(*) FROM service_visit WHERE date >= :day AND date < :next_day'),
+]
+
+
+def lookup_indexes():
+    # Indexes declared on the models, excluding the unique constraints of the initial schema
+    return [index for table in db.metadata.sorted_tables for index in table.indexes if not index.unique]
+
+
+def populate(conn, vehicles, visits_per_vehicle):
+    rng = random.Random(42)
+    customers = max(1, int(vehicles * CUSTOMERS_PER_VEHICLE))
+    start = datetime(2020, 1, 1)
+    conn.exec_driver_sql('DROP TRIGGER IF EXISTS vehicle_fts_ai')
+    conn.exec_driver_sql('DROP TRIGGER IF EXISTS customer_fts_ai')
+    conn.exec_driver_sql(
+        'INSERT INTO customer (id, name, phone, email) VALUES (?, ?, ?, ?)',
+        [(i, f'Customer {i}', f'07{i:08d}', f'c{i}@example.com') for i in range(1, customers + 1)]
+    )
+    conn.exec_driver_sql(
+        'INSERT INTO vehicle (id, name, model, plate, status, customer_id) VALUES (?, ?, ?, ?, ?, ?)',
+        [(i, 'Toyota', 'Corolla', f'K{i:07d}', 'Active', rng.randint(1, customers)) for i in range(1, vehicles + 1)]
+    )
+    visit_rows, item_rows, history_rows = [], [], []
+    visit_id = 0
+    for vehicle_id in range(1, vehicles + 1):
+        for _ in range(visits_per_vehicle):
+            visit_id += 1
+            date = start + timedelta(minutes=rng.randint(0, 5 * 365 * 24 * 60))
+            visit_rows.append((visit_id, vehicle_id, date, 'Service', 0))
+            for n in range(ITEMS_PER_VISIT):
+                item_rows.append((visit_id, f'Part {n}', 1, 1000, 100))
+            history_rows.append((vehicle_id, 'visit', date.strftime('%Y-%m-%d'), date, 'Service visit', visit_id))
+    conn.exec_driver_sql(
+        'INSERT INTO service_visit (id, vehicle_id, date, visit_category, labour) VALUES (?, ?, ?, ?, ?)', visit_rows
+    )
+    conn.exec_driver_sql(
+        'INSERT INTO service_item (visit_id, item_name, quantity, price, labour) VALUES (?, ?, ?, ?, ?)', item_rows
+    )
+    conn.exec_driver_sql(
+        'INSERT INTO vehicle_history (vehicle_id, event_type, date, timestamp, description, visit_id) '
+        'VALUES (?, ?, ?, ?, ?, ?)', history_rows
+    )
+    return customers, visit_id
+
+
+def run(conn, vehicles, customers, visits, label):
+    rng = random.Random(7)
+    print(f'\n== {label} ==')
+    for name, sql in QUERIES:
+        params = []
+        for _ in range(REPEAT):
+            day = datetime(2020, 1, 1) + timedelta(days=rng.randint(0, 5 * 365))
+            params.append({
+                'vehicle_id': rng.randint(1, vehicles),
+                'visit_id': rng.randint(1, max(1, visits - 2)),
+                'customer_id': rng.randint(1, customers),
+                'day': day,
+                'next_day': day + timedelta(days=1),
+            })
+        plan = conn.execute(text('EXPLAIN QUERY PLAN ' + sql), params[0]).fetchall()
+        started = time.perf_counter()
+        for p in params:
+            conn.execute(text(sql), p).fetchall()
+        elapsed = (time.perf_counter() - started) / REPEAT * 1000
+        print(f'{name:18} {elapsed:9.3f} ms  | ' + '; '.join(row[-1] for row in plan))
+
+
+def main():
+    vehicles = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    visits_per_vehicle = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        engine = create_engine(f'sqlite:///{path}')
+        db.metadata.create_all(engine)
+        indexes = lookup_indexes()
+        with engine.begin() as conn:
+            for index in indexes:
+                index.drop(conn)
+            print(f'Populating {vehicles} vehicles x {visits_per_vehicle} visits x {ITEMS_PER_VISIT} items...')
+            customers, visits = populate(conn, vehicles, visits_per_vehicle)
+            conn.exec_driver_sql('ANALYZE')
+        with engine.connect() as conn:
+            run(conn, vehicles, customers, visits, 'without lookup indexes')
+        with engine.begin() as conn:
+            for index in indexes:
+                index.create(conn)
+            conn.exec_driver_sql('ANALYZE')
+        with engine.connect() as conn:
+            run(conn, vehicles, customers, visits, 'with lookup indexes: ' + ', '.join(i.name for i in indexes))
+        engine.dispose()
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Time the key pages through the Flask test client.
+
+Usage: python bench_routes.py [requests_per_route] [--json results.json]
+
+Requests each route against random vehicles/visits of the configured
+database (fill one with generate_data.py and point DATABASE_URL at it) and
+prints p50/p95/max latency and the number of SQL statements per request.
+"cold" rows clear the report file cache or the dashboard statistics cache
+before every request, the other rows measure the cached path. With --json
+the results are also written to a file so runs can be compared.
+"""
+from app import app, db, User, Vehicle, ServiceVisit, report_cache, report_cache_key, stats_cache
+from metrics import QueryCounter
+from sqlalchemy.orm import joinedload
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+SEED = 3
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def sample(rng, model, n):
+    """`n` random ids of `model`, found without scanning the whole table."""
+    low, high = db.session.query(db.func.min(model.id), db.func.max(model.id)).one()
+    if low is None:
+        raise SystemExit(f'No {model.__tablename__} rows; run generate_data.py first.')
+    ids = []
+    while len(ids) < n:
+        row = db.session.query(model.id).filter(model.id >= rng.randint(low, high)).order_by(model.id).first()
+        if row:
+            ids.append(row[0])
+    return ids
+
+
+def drop_cached_report(vehicle_id):
+    with app.app_context():
+        v = db.session.get(Vehicle, vehicle_id, options=[joinedload(Vehicle.customer)])
+        path = report_cache.path(report_cache_key(v))
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def cases(rng, n):
+    with app.app_context():
+        vehicle_ids = sample(rng, Vehicle, n)
+        visit_ids = sample(rng, ServiceVisit, n)
+        plates = [p for (p,) in db.session.query(Vehicle.plate).filter(Vehicle.id.in_(vehicle_ids))]
+    return [
+        ('vehicles', [('/vehicles', None)] * n),
+        ('vehicles search', [(f'/vehicles?q={rng.choice(plates)[:4]}', None) for _ in range(n)]),
+        ('vehicle_detail', [(f'/vehicles/{vid}', None) for vid in vehicle_ids]),
+        ('vehicle_report cold', [(f'/vehicles/{vid}/report', lambda vid=vid: drop_cached_report(vid))
+                                 for vid in vehicle_ids]),
+        ('vehicle_report', [(f'/vehicles/{vid}/report', None) for vid in vehicle_ids]),
+        ('print_visit', [(f'/visit/{vid}/print', None) for vid in visit_ids]),
+        ('dashboard cold', [('/dashboard', stats_cache.invalidate)] * n),
+        ('dashboard', [('/dashboard', None)] * n),
+    ]
+
+
+def main():
+    args = sys.argv[1:]
+    json_path = None
+    if '--json' in args:
+        json_path = args[args.index('--json') + 1]
+        del args[args.index('--json'):args.index('--json') + 2]
+    n = int(args[0]) if args else 30
+    rng = random.Random(SEED)
+
+    with app.app_context():
+        admin = User.query.filter_by(role='admin').first() or User.query.first()
+        engines = list(db.engines.values())
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = admin.id if admin else 0
+        sess['username'] = admin.username if admin else 'admin'
+
+    results = {}
+    print(f'{"route":22} {"n":>4} {"p50 ms":>9} {"p95 ms":>9} {"max ms":>9} {"queries":>8}')
+    for name, requests in cases(rng, n):
+        latencies, queries = [], []
+        for url, prepare in requests:
+            if prepare:
+                prepare()
+            with QueryCounter(*engines) as counter:
+                started = time.perf_counter()
+                response = client.get(url)
+                response.get_data()  # drain streamed bodies
+                latencies.append((time.perf_counter() - started) * 1000)
+            if response.status_code != 200:
+                raise SystemExit(f'{url} returned {response.status_code}')
+            queries.append(counter.count)
+        results[name] = {
+            'n': len(latencies),
+            'p50_ms': round(percentile(latencies, 0.50), 2),
+            'p95_ms': round(percentile(latencies, 0.95), 2),
+            'max_ms': round(max(latencies), 2),
+            'queries': statistics.median(queries),
+        }
+        r = results[name]
+        print(f'{name:22} {r["n"]:>4} {r["p50_ms"]:>9.2f} {r["p95_ms"]:>9.2f} {r["max_ms"]:>9.2f} {r["queries"]:>8g}')
+
+    if json_path:
+        with open(json_path, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""Small in-process caches shared by the views."""
+import threading
+import time
+
+
+class TTLCache:
+    """Thread-safe mapping whose entries expire `ttl` seconds after being set.
+
+    The cache is per process; writers call invalidate() so this process sees
+    changes immediately, other worker processes pick them up within `ttl`.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._data = {}
+        self._lock = threading.Lock()
+        self._generation = 0  # bumped by invalidate() so in-flight computations are not stored
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+
+    def get_or_set(self, key, compute):
+        """Return the cached value for `key`, calling compute() on a miss."""
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            generation = self._generation
+            value = compute()
+            with self._lock:
+                if generation == self._generation:
+                    self._data[key] = (time.monotonic() + self.ttl, value)
+        return value
+
+    def invalidate(self, key=None):
+        """Drop `key`, or every entry when no key is given."""
+        with self._lock:
+            self._generation += 1
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
@@ -0,0 +1,94 @@
+"""Check that page query counts do not grow with a vehicle's visit history.
+
+Usage: python check_query_counts.py
+
+Runs against a throwaway instance directory with a freshly migrated SQLite
+database, never the configured one: creates two vehicles, one with a single
+visit and one with many, requests the detail, print and report pages of each
+through the Flask test client and fails if the number of SQL statements
+differs between them.
+"""
+import os
+import sys
+import tempfile
+
+from metrics import QueryCounter
+
+SMALL_HISTORY = 1
+LARGE_HISTORY = 25
+
+
+def make_vehicle(plate, visit_count):
+    from app import db, Vehicle, ServiceVisit, ServiceItem
+    v = Vehicle(name='QC', model='Query Count', plate=plate, status='Active')
+    db.session.add(v)
+    db.session.flush()
+    for n in range(visit_count):
+        visit = ServiceVisit(vehicle_id=v.id, notes=f'Visit {n}', visit_category='Diagnosis', labour=100)
+        db.session.add(visit)
+        db.session.flush()
+        for i in range(3):
+            db.session.add(ServiceItem(visit_id=visit.id, item_name=f'Part {i}', quantity=1, price=10, labour=5))
+    db.session.commit()
+    return v.id, visit.id
+
+
+def page_counts(client, vehicle_id, visit_id):
+    from app import db
+    counts = {}
+    for name, url in (
+        ('vehicle_detail', f'/vehicles/{vehicle_id}'),
+        ('print_visit', f'/visit/{visit_id}/print'),
+        ('vehicle_report', f'/vehicles/{vehicle_id}/report'),
+    ):
+        with QueryCounter(*db.engines.values()) as counter:
+            response = client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError(f'{url} returned {response.status_code}')
+        counts[name] = counter.count
+    return counts
+
+
+def measure():
+    """(small history counts, large history counts) from a freshly migrated database."""
+    from app import db, app, User
+    from flask_migrate import upgrade
+    with app.app_context():
+        upgrade(directory=os.path.join(app.root_path, 'migrations'))
+        admin = User(username='query-count', role='admin')
+        admin.set_password(os.urandom(16).hex())
+        db.session.add(admin)
+        db.session.commit()
+        small = make_vehicle('QC-SMALL-HISTORY', SMALL_HISTORY)
+        large = make_vehicle('QC-LARGE-HISTORY', LARGE_HISTORY)
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['user_id'] = admin.id
+            sess['username'] = admin.username
+        client.get('/dashboard')  # warm the per-process caches (user role) before counting
+        counts = page_counts(client, *small), page_counts(client, *large)
+        for engine in db.engines.values():
+            engine.dispose()  # close the database before its directory is removed
+    return counts
+
+
+def main():
+    with tempfile.TemporaryDirectory() as instance_path:
+        # app.py reads these when it is imported, so they are set before measure() imports it
+        os.environ.update(INSTANCE_PATH=instance_path, DATABASE_URL=f'sqlite:///{instance_path}/garage.db',
+                          FRAGMENT_CACHE='memory')
+        for name in ('DATABASE_READ_URL', 'ARCHIVE_PATH'):
+            os.environ.pop(name, None)
+        small_counts, large_counts = measure()
+
+    failed = False
+    for page, count in small_counts.items():
+        status = 'ok' if count == large_counts[page] else 'FAIL'
+        failed = failed or status == 'FAIL'
+        print(f'{page:16} {SMALL_HISTORY:>3} visits: {count:>3} queries | '
+              f'{LARGE_HISTORY:>3} visits: {large_counts[page]:>3} queries  {status}')
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
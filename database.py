@@ -0,0 +1,171 @@
+"""Database URL, engine options and SQLite pragmas.
+
+Everything can be overridden from the environment so the same code runs on
+the bundled SQLite file or on PostgreSQL:
+
+    DATABASE_URL           SQLAlchemy URL (default: sqlite:///garage.db)
+    DATABASE_READ_URL      engine for read-only views (default for SQLite: the
+                           primary file opened with mode=ro; otherwise none)
+    DB_POOL_SIZE           connections kept open per process
+    DB_MAX_OVERFLOW        extra connections allowed under load
+    DB_POOL_TIMEOUT        seconds to wait for a free connection
+    DB_POOL_RECYCLE        seconds before a connection is replaced
+    SQLITE_JOURNAL_MODE, SQLITE_SYNCHRONOUS, SQLITE_BUSY_TIMEOUT,
+    SQLITE_CACHE_SIZE, SQLITE_MMAP_SIZE
+                           override the pragmas in SQLITE_PRAGMAS
+"""
+import os
+import time
+from functools import wraps
+
+from flask import current_app, g, has_request_context, session as http_session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.sql.dml import UpdateBase
+
+
+DEFAULT_URL = 'sqlite:///garage.db'
+REPLICA = 'replica'  # SQLALCHEMY_BINDS key of the read engine
+
+# Applied to every new SQLite connection. WAL lets readers run while a writer
+# commits, NORMAL is durable across application crashes in WAL mode, and the
+# busy timeout makes writers queue instead of failing with "database is locked".
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,        # milliseconds
+    'cache_size': -20000,        # negative = KiB, so ~20 MB of page cache per connection
+    'mmap_size': 256 * 1024 * 1024,
+}
+
+POOL_OPTIONS = {
+    'DB_POOL_SIZE': 'pool_size',
+    'DB_MAX_OVERFLOW': 'max_overflow',
+    'DB_POOL_TIMEOUT': 'pool_timeout',
+    'DB_POOL_RECYCLE': 'pool_recycle',
+}
+
+
+def database_url(environ=os.environ):
+    url = environ.get('DATABASE_URL') or DEFAULT_URL
+    if url.startswith('postgres://'):  # Heroku-style URLs are not accepted by SQLAlchemy
+        url = 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+def replica_url(url, environ=os.environ):
+    """URL of the read engine, or None when reads should stay on the primary."""
+    if environ.get('DATABASE_READ_URL'):
+        return environ['DATABASE_READ_URL']
+    parsed = make_url(url)
+    if (parsed.get_backend_name() == 'sqlite' and parsed.database and parsed.database != ':memory:'
+            and not parsed.query.get('uri')):
+        # Separate read-only connections to the same file; with WAL they never block the writer
+        return parsed.set(database='file:' + parsed.database, query={'mode': 'ro', 'uri': 'true'}).render_as_string(
+            hide_password=False)
+    return None
+
+
+def engine_options(url, environ=os.environ):
+    """SQLALCHEMY_ENGINE_OPTIONS for `url` with pool settings taken from the environment."""
+    options = {}
+    if make_url(url).get_backend_name() != 'sqlite':
+        options['pool_pre_ping'] = True
+    for var, option in POOL_OPTIONS.items():
+        if environ.get(var):
+            options[option] = int(environ[var])
+    return options
+
+
+def sqlite_pragmas(pragmas=None, environ=os.environ):
+    """`pragmas` (default SQLITE_PRAGMAS) with SQLITE_<NAME> environment overrides applied."""
+    result = dict(SQLITE_PRAGMAS if pragmas is None else pragmas)
+    for name in result:
+        value = environ.get('SQLITE_' + name.upper())
+        if value:
+            result[name] = value
+    return result
+
+
+def install_pragmas(engine, pragmas):
+    """Run `PRAGMA name = value` on each new connection of a SQLite `engine`."""
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+    statements = [f'PRAGMA {name} = {value}' for name, value in pragmas.items()]
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for statement in statements:
+                cursor.execute(statement)
+        finally:
+            cursor.close()
+
+
+def replica_pragmas(pragmas):
+    """Pragmas for read-only connections: no journal mode change, and refuse writes."""
+    result = {name: value for name, value in pragmas.items() if name != 'journal_mode'}
+    result['query_only'] = 'ON'
+    return result
+
+
+def current_pragmas(connection):
+    """The effective values of the tuned pragmas on `connection` (for diagnostics)."""
+    return {name: connection.exec_driver_sql(f'PRAGMA {name}').scalar() for name in SQLITE_PRAGMAS}
+
+
+# Read routing: views marked read_only (and background report renders) query
+# the replica engine. Flushes, DML statements and any request made shortly
+# after the same browser session committed a write use the primary, so users
+# always read their own writes even when the replica lags.
+
+def use_replica():
+    """Send the reads of the current request or app context to the replica."""
+    g.db_read_only = True
+
+
+def read_only(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        use_replica()
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def pin_to_primary():
+    """Read from the primary for READ_YOUR_WRITES_SECONDS, e.g. after writes made outside db.session."""
+    http_session['db_primary_until'] = time.time() + current_app.config['READ_YOUR_WRITES_SECONDS']
+
+
+def _pinned_to_primary():
+    return has_request_context() and http_session.get('db_primary_until', 0) > time.time()
+
+
+class RoutingSession(Session):
+    """db.session class choosing the replica engine for reads of read-only views."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and not isinstance(clause, UpdateBase)
+                and g.get('db_read_only') and not _pinned_to_primary()):
+            engine = self._db.engines.get(REPLICA)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _remember_write(session, flush_context):
+    session.info['db_wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _pin_to_primary(session):
+    if session.info.pop('db_wrote', False) and has_request_context():
+        pin_to_primary()
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _forget_write(session):
+    session.info.pop('db_wrote', None)
@@ -1,4 +1,4 @@
-from app import db, Customer, Vehicle, ServiceVisit, ServiceItem, app
+from app import db, Customer, Vehicle, ServiceVisit, ServiceItem, app, add_vehicle_note, link_unlinked_items
 import random
 import sys
 from datetime import datetime, timedelta
@@ -74,11 +74,11 @@ def add_demo_data():
                 type=random.choice(["Mechanical", "Electrical", "Service"]),
                 status="Active",
                 date_booked=(datetime.now() - timedelta(days=random.randint(1, 365))).strftime("%Y-%m-%d"),
-                technician=random.choice(["Tech Demo", "Alex", "Sam", "Grace"]),
-                history="Demo vehicle history"
+                technician=random.choice(["Tech Demo", "Alex", "Sam", "Grace"])
             )
             db.session.add(vehicle)
             db.session.flush()
+            add_vehicle_note(vehicle, "Demo vehicle history")
 
             # Add two visits per vehicle, each with a different category
             visit_types = random.sample(VISIT_CATEGORIES, 2)
@@ -89,18 +89,19 @@ def add_demo_data():
                     visit_category=cat,
                     labour=sum(item['labour'] for item in items)
                 )
-                db.session.add(visit)
-                db.session.flush()
                 for item in items:
-                    db.session.add(ServiceItem(
-                        visit_id=visit.id,
+                    visit.items.append(ServiceItem(
                         item_name=item['item_name'],
                         part_number=item['part_number'],
                         quantity=item['quantity'],
                         price=item['price'],
                         labour=item['labour']
                     ))
+                visit.update_totals()
+                db.session.add(visit)
     db.session.commit()
+    # The items above are not linked to catalogue parts; the recount also covers the items deleted first
+    link_unlinked_items(recount=True)
     print("Demo data added.")
 
 def remove_demo_data():
@@ -110,6 +111,7 @@ def remove_demo_data():
     db.session.query(Vehicle).delete()
     db.session.query(Customer).delete()
     db.session.commit()
+    link_unlinked_items(recount=True)  # part usage counts and last prices of the deleted items
     print("Demo data removed.")
 
 if __name__ == "__main__":
@@ -0,0 +1,67 @@
+"""Streaming CSV and JSON export of service visits and their items.
+
+The writers take an iterable of result rows, one per visit item (visits
+without items appear once with empty item columns), ordered by visit id, and
+yield text chunks. Only one chunk is held in memory at a time, so exports of
+any size run in constant memory as long as the rows come from a streaming
+(yield_per) query.
+"""
+import csv
+import io
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from itertools import groupby
+
+
+VISIT_FIELDS = [
+    'visit_id', 'date', 'plate', 'vehicle', 'model', 'customer_id', 'customer', 'visit_category', 'notes',
+    'labour', 'parts_total', 'items_labour_total', 'grand_total',
+]
+ITEM_FIELDS = ['item_id', 'item_name', 'part_number', 'quantity', 'price', 'item_labour']
+ROWS_PER_CHUNK = 500
+FORMATS = {'csv': 'text/csv', 'json': 'application/json'}
+
+
+def _plain(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def csv_chunks(rows, rows_per_chunk=ROWS_PER_CHUNK):
+    """CSV text with a header line, one line per item."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(VISIT_FIELDS + ITEM_FIELDS)
+    for n, row in enumerate(rows, start=1):
+        writer.writerow([_plain(row[field]) for field in VISIT_FIELDS + ITEM_FIELDS])
+        if n % rows_per_chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def json_chunks(rows, visits_per_chunk=ROWS_PER_CHUNK):
+    """A JSON array of visits, each with its list of items."""
+    parts = ['[']
+    for n, (_, visit_rows) in enumerate(groupby(rows, key=lambda row: row['visit_id'])):
+        visit_rows = list(visit_rows)
+        visit = {field: _plain(visit_rows[0][field]) for field in VISIT_FIELDS}
+        visit['items'] = [
+            {field: _plain(row[field]) for field in ITEM_FIELDS}
+            for row in visit_rows if row['item_id'] is not None
+        ]
+        parts.append((',\n' if n else '\n') + json.dumps(visit))
+        if len(parts) >= visits_per_chunk:
+            yield ''.join(parts)
+            parts = []
+    parts.append('\n]\n')
+    yield ''.join(parts)
+
+
+def chunks(fmt, rows):
+    return csv_chunks(rows) if fmt == 'csv' else json_chunks(rows)
@@ -0,0 +1,175 @@
+"""Cache of rendered HTML fragments (vehicle rows, visit cards).
+
+Each entry is stored with a version token. A fragment is only reused when
+the token still matches the row's current version, so a stale entry can
+never be served, even from a cache shared by several worker processes.
+Writers also delete entries as soon as the rows change (see app.py), which
+frees the space early.
+
+Backends:
+
+    MemoryBackend   per-process LRU bounded by entry count and total bytes
+    SQLiteBackend   a local SQLite file shared by all workers on the host
+    NullBackend     caching disabled
+"""
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+class NullBackend:
+    def get_many(self, keys):
+        return {}
+
+    def set_many(self, entries):
+        pass
+
+    def delete_many(self, keys):
+        pass
+
+    def clear(self):
+        pass
+
+
+class MemoryBackend:
+    """LRU mapping key -> (token, html) bounded by `max_entries` and `max_bytes`."""
+
+    def __init__(self, max_entries=20000, max_bytes=32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self._data.get(key)
+                if entry is not None:
+                    self._data.move_to_end(key)
+                    found[key] = entry
+        return found
+
+    def set_many(self, entries):
+        with self._lock:
+            for key, (token, html) in entries.items():
+                old = self._data.pop(key, None)
+                if old is not None:
+                    self._bytes -= len(old[1])
+                self._data[key] = (token, html)
+                self._bytes += len(html)
+            while self._data and (len(self._data) > self.max_entries or self._bytes > self.max_bytes):
+                _, (_, html) = self._data.popitem(last=False)
+                self._bytes -= len(html)
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                old = self._data.pop(key, None)
+                if old is not None:
+                    self._bytes -= len(old[1])
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+
+class SQLiteBackend:
+    """Fragments in a SQLite file; one connection per thread and process."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS fragment (key TEXT PRIMARY KEY, token TEXT, html TEXT)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            # A connection inherited through fork (e.g. gunicorn preload_app) must not be reused
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=5)
+            self._local.pid = os.getpid()
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = OFF')  # a lost fragment is only a cache miss
+        return conn
+
+    def get_many(self, keys):
+        if not keys:
+            return {}
+        keys = list(keys)
+        conn = self._connect()
+        found = {}
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            rows = conn.execute(
+                f'SELECT key, token, html FROM fragment WHERE key IN ({", ".join("?" * len(batch))})', batch
+            )
+            found.update((key, (token, html)) for key, token, html in rows)
+        return found
+
+    def set_many(self, entries):
+        if entries:
+            with self._connect() as conn:
+                conn.executemany('INSERT OR REPLACE INTO fragment (key, token, html) VALUES (?, ?, ?)',
+                                 [(key, token, html) for key, (token, html) in entries.items()])
+
+    def delete_many(self, keys):
+        if keys:
+            with self._connect() as conn:
+                conn.executemany('DELETE FROM fragment WHERE key = ?', [(key,) for key in keys])
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM fragment')
+
+
+def make_backend(kind, **options):
+    if kind == 'memory':
+        return MemoryBackend(options.get('max_entries', 20000), options.get('max_bytes', 32 * 1024 * 1024))
+    if kind == 'sqlite':
+        return SQLiteBackend(options['path'])
+    if kind in (None, '', 'none'):
+        return NullBackend()
+    raise ValueError(f'Unknown fragment cache backend {kind!r}')
+
+
+class FragmentCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def render_many(self, items, key, token, render):
+        """HTML of each item, reusing cached fragments whose token still matches.
+
+        key(item) and token(item) give the cache key and current version token
+        of an item. render(misses) renders the items not found, in one call,
+        so their data can be loaded in a single query.
+        """
+        keys = [key(item) for item in items]
+        tokens = [token(item) for item in items]
+        cached = self.backend.get_many(set(keys))
+        html = [None] * len(items)
+        misses = []
+        for i, (k, t) in enumerate(zip(keys, tokens)):
+            entry = cached.get(k)
+            if entry is not None and entry[0] == t:
+                html[i] = entry[1]
+            else:
+                misses.append(i)
+        self.hits += len(items) - len(misses)
+        self.misses += len(misses)
+        if misses:
+            fresh = {}
+            for i, fragment in zip(misses, render([items[i] for i in misses])):
+                html[i] = fragment
+                fresh[keys[i]] = (tokens[i], fragment)
+            self.backend.set_many(fresh)
+        return html
+
+    def invalidate(self, keys):
+        self.backend.delete_many(keys)
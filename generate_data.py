@@ -0,0 +1,181 @@
+"""Fill the database with a large, reproducible synthetic data set.
+
+Usage: python generate_data.py [--customers N] [--vehicles N] [--visits N]
+                               [--items-per-visit N] [--years N] [--seed N]
+
+Rows are appended to the database configured for the app (set DATABASE_URL
+to generate into a separate file, e.g. sqlite:////tmp/bench.db; missing
+tables are created from the models). Inserts are batched executemany
+statements through SQLAlchemy Core. The same seed produces the same data;
+dates are relative to today's midnight, so they shift from day to day.
+Each visit gets 1..--items-per-visit items (2.5 on average with the
+default), so this large profile gives about 5M items:
+
+    python generate_data.py --customers 100000 --vehicles 300000 --visits 2000000
+"""
+from app import app, db, stats_cache, link_unlinked_items, log_bulk_inserts
+from demo_data import CUSTOMER_NAMES, MAKES_MODELS, VISIT_CATEGORIES
+from datetime import datetime, timedelta
+from decimal import Decimal
+import argparse
+import random
+import time
+
+BATCH_SIZE = 10000
+TECHNICIANS = ['Tech Demo', 'Alex', 'Sam', 'Grace', 'Wanjiru', 'Otieno']
+VEHICLE_TYPES = ['Mechanical', 'Electrical', 'Service']
+NOTES = ['No major issues.', 'Parts replaced.', 'System updated.', 'Customer to return for follow-up.']
+
+
+def midnight():
+    return datetime.combine(datetime.now().date(), datetime.min.time())
+
+
+def next_id(conn, table):
+    return (conn.execute(db.select(db.func.max(table.c.id))).scalar() or 0) + 1
+
+
+def insert_batches(table, rows, label):
+    """Insert `rows` (an iterator of dicts) in BATCH_SIZE transactions; returns the row count."""
+    count, batch, started = 0, [], time.perf_counter()
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            count += flush(table, batch)
+            print(f'\r{label}: {count}', end='', flush=True)
+    count += flush(table, batch)
+    elapsed = time.perf_counter() - started
+    print(f'\r{label}: {count} in {elapsed:.1f}s ({count / max(elapsed, 1e-6):.0f} rows/s)')
+    return count
+
+
+def flush(table, batch):
+    if not batch:
+        return 0
+    with db.engine.begin() as conn:
+        conn.execute(table.insert(), batch)
+    count = len(batch)
+    batch.clear()
+    return count
+
+
+def insert_visits(tables, visit_rows, item_rows):
+    """Insert visits in batches, each followed by the items generated for it."""
+    visits = items = 0
+    batch, started = [], time.perf_counter()
+    for row in visit_rows:
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            visits += flush(tables['service_visit'], batch)
+            items += flush(tables['service_item'], item_rows)
+            print(f'\rvisits: {visits}, items: {items}', end='', flush=True)
+    visits += flush(tables['service_visit'], batch)
+    items += flush(tables['service_item'], item_rows)
+    elapsed = time.perf_counter() - started
+    print(f'\rvisits: {visits}, items: {items} in {elapsed:.1f}s ({(visits + items) / max(elapsed, 1e-6):.0f} rows/s)')
+
+
+def customers(rng, first_id, count):
+    for customer_id in range(first_id, first_id + count):
+        name = f'{rng.choice(CUSTOMER_NAMES)} {customer_id}'
+        yield {
+            'id': customer_id,
+            'name': name,
+            'phone': f'07{rng.randint(10000000, 99999999)}',
+            'email': f"{name.lower().replace(' ', '.')}@example.com",
+        }
+
+
+def vehicles(rng, first_id, count, customer_ids):
+    today = midnight()
+    for vehicle_id in range(first_id, first_id + count):
+        make, models = rng.choice(MAKES_MODELS)
+        yield {
+            'id': vehicle_id,
+            'customer_id': rng.randint(*customer_ids) if customer_ids else None,
+            'name': make,
+            'model': rng.choice(models),
+            'plate': f'G{vehicle_id:07d}',
+            'vin_number': f'VIN{rng.randint(10 ** 9, 10 ** 10 - 1)}',
+            'type': rng.choice(VEHICLE_TYPES),
+            'status': 'Active' if rng.random() < 0.2 else 'Completed',
+            'date_booked': (today - timedelta(days=rng.randint(0, 365))).strftime('%Y-%m-%d'),
+            'technician': rng.choice(TECHNICIANS),
+        }
+
+
+def visits_and_items(rng, first_visit_id, first_item_id, count, vehicle_ids, items_per_visit, years, item_rows):
+    """Yield visit rows; their item rows are appended to `item_rows` for the caller to insert."""
+    parts = [(category, item) for category, items in VISIT_CATEGORIES for item in items]
+    now = midnight()
+    span = int(years * 365 * 24 * 60)
+    item_id = first_item_id
+    for visit_id in range(first_visit_id, first_visit_id + count):
+        category, _ = rng.choice(VISIT_CATEGORIES)
+        chosen = [rng.choice(parts)[1] for _ in range(rng.randint(1, items_per_visit))]
+        labour = Decimal(rng.choice([0, 500, 1000, 1500, 2500]))
+        parts_total = sum((Decimal(item['price']) * item['quantity'] for item in chosen), Decimal('0.00'))
+        items_labour = sum((Decimal(item['labour']) for item in chosen), Decimal('0.00'))
+        for item in chosen:
+            item_rows.append({
+                'id': item_id, 'visit_id': visit_id, 'item_name': item['item_name'],
+                'part_number': item['part_number'], 'quantity': item['quantity'],
+                'price': float(item['price']), 'labour': float(item['labour']),
+            })
+            item_id += 1
+        yield {
+            'id': visit_id,
+            'vehicle_id': rng.randint(*vehicle_ids),
+            'date': now - timedelta(minutes=rng.randint(0, span)),
+            'notes': f'{category} performed. {rng.choice(NOTES)}',
+            'visit_category': category,
+            'labour': float(labour),
+            'parts_total': parts_total,
+            'items_labour_total': items_labour,
+            'grand_total': parts_total + items_labour + labour,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Append synthetic customers, vehicles, visits and items.')
+    parser.add_argument('--customers', type=int, default=1000)
+    parser.add_argument('--vehicles', type=int, default=3000)
+    parser.add_argument('--visits', type=int, default=20000)
+    parser.add_argument('--items-per-visit', type=int, default=4, help='maximum items per visit (minimum 1)')
+    parser.add_argument('--years', type=float, default=3, help='visit dates are spread over this many past years')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    tables = db.metadata.tables
+    with app.app_context():
+        db.create_all()
+        with db.engine.connect() as conn:
+            customer_id = next_id(conn, tables['customer'])
+            vehicle_id = next_id(conn, tables['vehicle'])
+            visit_id = next_id(conn, tables['service_visit'])
+            item_id = next_id(conn, tables['service_item'])
+        print(f'Generating into {db.engine.url.render_as_string(hide_password=True)} (seed {args.seed})')
+
+        insert_batches(tables['customer'], customers(rng, customer_id, args.customers), 'customers')
+        customer_range = (customer_id, customer_id + args.customers - 1) if args.customers else None
+        insert_batches(tables['vehicle'], vehicles(rng, vehicle_id, args.vehicles, customer_range), 'vehicles')
+        if args.vehicles and args.visits:
+            item_rows = []
+            visit_rows = visits_and_items(rng, visit_id, item_id, args.visits,
+                                          (vehicle_id, vehicle_id + args.vehicles - 1),
+                                          max(1, args.items_per_visit), args.years, item_rows)
+            insert_visits(tables, visit_rows, item_rows)
+            started = time.perf_counter()
+            print(f'catalogue: {link_unlinked_items()} items linked in {time.perf_counter() - started:.1f}s')
+        started = time.perf_counter()
+        logged = log_bulk_inserts('vehicles', vehicle_id - 1) + log_bulk_inserts('visits', visit_id - 1)
+        print(f'timeline: {logged} entries in {time.perf_counter() - started:.1f}s')
+        with db.engine.begin() as conn:
+            if db.engine.dialect.name == 'sqlite':
+                conn.exec_driver_sql('ANALYZE')
+        stats_cache.invalidate()
+
+
+if __name__ == '__main__':
+    main()
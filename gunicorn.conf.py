@@ -0,0 +1,34 @@
+"""gunicorn settings; see wsgi.py. Environment overrides: BIND, WEB_CONCURRENCY, THREADS, TIMEOUT."""
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '127.0.0.1:5001')
+
+# Processes for CPU-bound work (PDFs, templates), threads to overlap database and network waits.
+# SQLite in WAL mode lets the workers read concurrently; writes are still serialised by the database.
+workers = int(os.environ.get('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 8)))
+worker_class = 'gthread'
+threads = int(os.environ.get('THREADS', 4))
+
+# Load the app once in the master and fork workers from it
+preload_app = True
+
+# Synchronous report downloads of long histories can take a while
+timeout = int(os.environ.get('TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers now and then to bound memory growth of the in-process caches
+max_requests = 2000
+max_requests_jitter = 200
+
+accesslog = '-'
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    # Connections opened in the master must not be shared with the workers
+    from app import app, db
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
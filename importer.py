@@ -0,0 +1,291 @@
+"""Bulk import of customers, vehicles and service history from CSV or XLSX.
+
+Rows are read as a stream, validated and converted in Python, and written
+with one executemany INSERT per table and chunk, each chunk in its own
+transaction. Rows that fail validation are skipped and reported with their
+line number; the rest of the file is still imported.
+
+Expected columns (header names are case-insensitive):
+
+    customers  name, phone, email
+    vehicles   plate, name, model, [status, vin_number, type, date_booked,
+               technician, customer_id | customer_email]
+    visits     plate, date, [visit_category, notes, labour, visit_ref,
+               item_name, part_number, quantity, price, item_labour]
+
+A visits file has one line per service item. Consecutive lines with the same
+plate, date and visit_ref make up one visit; a line without item_name is a
+visit without items.
+
+The inserts go through SQLAlchemy Core, so ORM session events do not fire;
+callers must invalidate their caches after an import.
+"""
+import csv
+import io
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from itertools import groupby
+
+from sqlalchemy import select
+
+
+KINDS = ('customers', 'vehicles', 'visits')
+DEFAULT_CHUNK_SIZE = 2000
+MAX_REPORTED_ERRORS = 1000
+DATE_FORMATS = ('%Y-%m-%d', '%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S', '%d/%m/%Y')
+CENT = Decimal('0.01')
+
+
+class ImportResult:
+    def __init__(self, kind):
+        self.kind = kind
+        self.rows = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.error_count = 0
+        self.errors = []  # (line, message), at most MAX_REPORTED_ERRORS
+
+    def error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+    def to_dict(self):
+        return {
+            'kind': self.kind, 'rows': self.rows, 'inserted': self.inserted, 'duplicates': self.duplicates,
+            'error_count': self.error_count, 'errors': [{'line': line, 'error': msg} for line, msg in self.errors],
+        }
+
+
+def read_rows(stream, filename):
+    """Yield (line number, {lower-case header: value}) from a binary CSV or XLSX file object."""
+    if filename.lower().endswith('.xlsx'):
+        return _read_xlsx(stream)
+    return _read_csv(stream)
+
+
+def _read_csv(stream):
+    reader = csv.reader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    header = [name.strip().lower() for name in next(reader, [])]
+    for row in reader:
+        if any(cell.strip() for cell in row):
+            yield reader.line_num, dict(zip(header, row))
+
+
+def _read_xlsx(stream):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ValueError('Reading .xlsx files requires the openpyxl package; upload a CSV file instead.')
+    workbook = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [str(name or '').strip().lower() for name in next(rows, ())]
+        for line, row in enumerate(rows, start=2):
+            if any(cell not in (None, '') for cell in row):
+                yield line, dict(zip(header, row))
+    finally:
+        workbook.close()
+
+
+# Field converters raise ValueError with a message suitable for the error report
+
+def _text(row, field, required=False, limit=None):
+    value = row.get(field)
+    value = '' if value is None else str(value).strip()
+    if required and not value:
+        raise ValueError(f'{field} is required')
+    if limit and len(value) > limit:
+        raise ValueError(f'{field} is longer than {limit} characters')
+    return value or None
+
+
+def _number(row, field, default=0):
+    value = row.get(field)
+    if value is None or str(value).strip() == '':
+        return default
+    try:
+        return Decimal(str(value).strip().replace(',', '')).quantize(CENT, rounding=ROUND_HALF_UP)
+    except InvalidOperation:
+        raise ValueError(f'{field} is not a number: {value!r}')
+
+
+def _date(row, field):
+    value = row.get(field)
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    value = _text(row, field, required=True)
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise ValueError(f'{field} is not a date (YYYY-MM-DD): {value!r}')
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def import_rows(engine, tables, kind, rows, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Import `rows` (from read_rows) of `kind` into the tables of `tables` (name -> Table)."""
+    if kind not in KINDS:
+        raise ValueError(f'Unknown import kind {kind!r}; expected one of {", ".join(KINDS)}')
+    result = ImportResult(kind)
+    importer = {'customers': _import_customers, 'vehicles': _import_vehicles, 'visits': _import_visits}[kind]
+    importer(engine, tables, rows, chunk_size, result)
+    return result
+
+
+def _insert(engine, table, records, result, lines):
+    if not records:
+        return
+    try:
+        with engine.begin() as conn:
+            conn.execute(table.insert(), records)
+    except Exception as exc:
+        for line in lines:
+            result.error(line, f'not imported, the batch failed: {exc.__class__.__name__}')
+        return
+    result.inserted += len(records)
+
+
+def _import_customers(engine, tables, rows, chunk_size, result):
+    table = tables['customer']
+    for chunk in _chunks(rows, chunk_size):
+        records, lines = [], []
+        for line, row in chunk:
+            result.rows += 1
+            try:
+                records.append({
+                    'name': _text(row, 'name', required=True, limit=100),
+                    'phone': _text(row, 'phone', required=True, limit=20),
+                    'email': _text(row, 'email', required=True, limit=100),
+                })
+                lines.append(line)
+            except ValueError as exc:
+                result.error(line, str(exc))
+        _insert(engine, table, records, result, lines)
+
+
+def _import_vehicles(engine, tables, rows, chunk_size, result):
+    table, customers = tables['vehicle'], tables['customer']
+    with engine.connect() as conn:
+        plates = {plate.lower() for (plate,) in conn.execute(select(table.c.plate))}
+        customer_ids, known_ids = {}, set()
+        for customer_id, email in conn.execute(select(customers.c.id, customers.c.email)):
+            customer_ids.setdefault(email.lower(), customer_id)
+            known_ids.add(customer_id)
+    for chunk in _chunks(rows, chunk_size):
+        records, lines = [], []
+        for line, row in chunk:
+            result.rows += 1
+            try:
+                plate = _text(row, 'plate', required=True, limit=20)
+                if plate.lower() in plates:
+                    result.duplicates += 1
+                    result.error(line, f'plate {plate} already exists')
+                    continue
+                customer_id = None
+                if _text(row, 'customer_id'):
+                    customer_id = int(_number(row, 'customer_id'))
+                    if customer_id not in known_ids:
+                        raise ValueError(f'customer_id {customer_id} does not exist')
+                elif _text(row, 'customer_email'):
+                    email = _text(row, 'customer_email').lower()
+                    if email not in customer_ids:
+                        raise ValueError(f'no customer with email {email}')
+                    customer_id = customer_ids[email]
+                records.append({
+                    'plate': plate,
+                    'name': _text(row, 'name', required=True, limit=100),
+                    'model': _text(row, 'model', required=True, limit=100),
+                    'status': _text(row, 'status', limit=50) or 'Active',
+                    'vin_number': _text(row, 'vin_number', limit=100),
+                    'type': _text(row, 'type', limit=50),
+                    'date_booked': _text(row, 'date_booked', limit=20),
+                    'technician': _text(row, 'technician', limit=100),
+                    'customer_id': customer_id,
+                })
+                lines.append(line)
+                plates.add(plate.lower())
+            except ValueError as exc:
+                result.error(line, str(exc))
+        _insert(engine, table, records, result, lines)
+
+
+def _visit_groups(rows):
+    """Group consecutive item lines of the same visit: yields [(line, row), ...]."""
+    def key(entry):
+        row = entry[1]
+        return (str(row.get('plate') or '').strip().lower(), str(row.get('date') or '').strip(),
+                str(row.get('visit_ref') or '').strip())
+    for _, group in groupby(rows, key=key):
+        yield list(group)
+
+
+def _import_visits(engine, tables, rows, chunk_size, result):
+    visits, items, vehicles = tables['service_visit'], tables['service_item'], tables['vehicle']
+    with engine.connect() as conn:
+        vehicle_ids = {plate.lower(): vehicle_id for vehicle_id, plate in conn.execute(select(vehicles.c.id, vehicles.c.plate))}
+    insert_visits = visits.insert().returning(visits.c.id, sort_by_parameter_order=True)
+    for chunk in _chunks(_visit_groups(rows), chunk_size):
+        visit_records, visit_items, lines = [], [], []
+        for group in chunk:
+            result.rows += len(group)
+            line, first = group[0]
+            try:
+                plate = _text(first, 'plate', required=True)
+                if plate.lower() not in vehicle_ids:
+                    raise ValueError(f'no vehicle with plate {plate}')
+                visit_date = _date(first, 'date')
+                labour = _number(first, 'labour')
+                group_items = []
+                for line, row in group:
+                    if _text(row, 'item_name'):
+                        group_items.append({
+                            'item_name': _text(row, 'item_name', limit=100),
+                            'part_number': _text(row, 'part_number', limit=100),
+                            'quantity': int(_number(row, 'quantity', default=1)),
+                            'price': _number(row, 'price'),
+                            'labour': _number(row, 'item_labour'),
+                        })
+                parts_total = sum((i['price'] * i['quantity'] for i in group_items), Decimal('0.00'))
+                items_labour = sum((i['labour'] for i in group_items), Decimal('0.00'))
+                visit_records.append({
+                    'vehicle_id': vehicle_ids[plate.lower()],
+                    'date': visit_date,
+                    'visit_category': _text(first, 'visit_category', limit=100),
+                    'notes': _text(first, 'notes', limit=255),
+                    'labour': float(labour),
+                    'parts_total': parts_total,
+                    'items_labour_total': items_labour,
+                    'grand_total': parts_total + items_labour + labour,
+                })
+                visit_items.append(group_items)
+                lines.extend(l for l, _ in group)
+            except ValueError as exc:
+                result.error(line, f'visit skipped: {exc}')
+        if not visit_records:
+            continue
+        try:
+            with engine.begin() as conn:
+                visit_ids = [row[0] for row in conn.execute(insert_visits, visit_records)]
+                item_records = [dict(item, visit_id=visit_id, price=float(item['price']), labour=float(item['labour']))
+                                for visit_id, group_items in zip(visit_ids, visit_items) for item in group_items]
+                if item_records:
+                    conn.execute(items.insert(), item_records)
+        except Exception as exc:
+            for line in lines:
+                result.error(line, f'not imported, the batch failed: {exc.__class__.__name__}')
+            continue
+        result.inserted += len(visit_records)
@@ -0,0 +1,235 @@
+"""Request, SQL and template timing with a Prometheus text exporter.
+
+RequestMetrics hooks into Flask's request and template signals and into
+SQLAlchemy engine events. Per request it measures the total latency, the
+number and time of SQL statements and the time spent rendering templates,
+and folds them into fixed-bucket histograms per endpoint. Statements slower
+than `slow_query_ms` are logged with their parameters and kept in a short
+ring buffer for the debug panel.
+
+Everything is in-process: each worker exports its own numbers, so scrape the
+workers individually or aggregate with the usual Prometheus sum() queries.
+The per-statement cost is two perf_counter() calls and a few additions.
+"""
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from flask import g, has_app_context, request, template_rendered, before_render_template
+from sqlalchemy import event
+
+
+logger = logging.getLogger('garage.slow_query')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield bound, total
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (an estimate, like histogram_quantile)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        for bound, total in self.cumulative():
+            if total >= rank:
+                return bound if bound != float('inf') else self.buckets[-1]
+        return self.buckets[-1]
+
+
+class QueryCounter:
+    """Context manager counting SQL statements sent to the given engines."""
+
+    def __init__(self, *engines):
+        self.engines = engines
+        self.count = 0
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+    def __enter__(self):
+        for engine in self.engines:
+            event.listen(engine, 'before_cursor_execute', self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        for engine in self.engines:
+            event.remove(engine, 'before_cursor_execute', self._on_execute)
+
+
+class RequestMetrics:
+    def __init__(self, app=None, slow_query_ms=200, keep_slow=50):
+        self.slow_query_ms = slow_query_ms
+        self.slow_queries = deque(maxlen=keep_slow)
+        self._lock = threading.Lock()
+        self._latency = {}
+        self._queries = {}
+        self._sql_time = {}
+        self._template_time = {}
+        self._requests = {}  # (endpoint, method, status) -> count
+        self._slow_total = 0
+        self.started = time.time()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.slow_query_ms = app.config.get('SLOW_QUERY_MS', self.slow_query_ms)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+
+    def watch_engine(self, engine):
+        event.listen(engine, 'before_cursor_execute', self._before_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_execute)
+
+    # Flask hooks
+
+    def _before_request(self):
+        g.metrics_started = time.perf_counter()
+        g.metrics_queries = 0
+        g.metrics_sql_time = 0.0
+        g.metrics_template_time = 0.0
+
+    def _after_request(self, response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        endpoint = request.endpoint or 'unmatched'
+        with self._lock:
+            self._histogram(self._latency, endpoint, LATENCY_BUCKETS).observe(elapsed)
+            self._histogram(self._queries, endpoint, QUERY_COUNT_BUCKETS).observe(g.metrics_queries)
+            self._histogram(self._sql_time, endpoint, LATENCY_BUCKETS).observe(g.metrics_sql_time)
+            self._histogram(self._template_time, endpoint, LATENCY_BUCKETS).observe(g.metrics_template_time)
+            key = (endpoint, request.method, response.status_code)
+            self._requests[key] = self._requests.get(key, 0) + 1
+        response.headers['Server-Timing'] = (
+            f'db;desc="{g.metrics_queries} queries";dur={g.metrics_sql_time * 1000:.1f}, '
+            f'tpl;dur={g.metrics_template_time * 1000:.1f}, total;dur={elapsed * 1000:.1f}'
+        )
+        return response
+
+    def _before_render(self, sender, template, context, **extra):
+        if 'metrics_started' in g:
+            g.metrics_render_started = time.perf_counter()
+
+    def _after_render(self, sender, template, context, **extra):
+        started = g.pop('metrics_render_started', None)
+        if started is not None:
+            g.metrics_template_time += time.perf_counter() - started
+
+    @contextmanager
+    def template_timer(self):
+        """Count a template rendered without render_template (cached fragments) in the request's template time."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            if has_app_context() and 'metrics_started' in g:
+                g.metrics_template_time += time.perf_counter() - started
+
+    # Engine events
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info['metrics_started'] = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.pop('metrics_started', None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        in_request = has_app_context() and 'metrics_started' in g
+        if in_request:
+            g.metrics_queries += 1
+            g.metrics_sql_time += elapsed
+        if elapsed * 1000 >= self.slow_query_ms:
+            params = parameters if not executemany else f'{len(parameters)} parameter sets'
+            endpoint = request.endpoint if in_request else None
+            logger.warning('slow query (%.1f ms, %s): %s; parameters: %r', elapsed * 1000,
+                           endpoint or 'no request', statement, params)
+            with self._lock:
+                self._slow_total += 1
+                self.slow_queries.appendleft({
+                    'at': time.strftime('%Y-%m-%d %H:%M:%S'), 'ms': round(elapsed * 1000, 1), 'endpoint': endpoint,
+                    'statement': statement, 'parameters': repr(params)[:500],
+                })
+
+    # Reporting
+
+    @staticmethod
+    def _histogram(store, endpoint, buckets):
+        histogram = store.get(endpoint)
+        if histogram is None:
+            histogram = store[endpoint] = Histogram(buckets)
+        return histogram
+
+    def summary(self):
+        """Per-endpoint figures for the debug panel, slowest p95 first."""
+        rows = []
+        with self._lock:
+            for endpoint, latency in self._latency.items():
+                n = latency.count
+                rows.append({
+                    'endpoint': endpoint,
+                    'requests': n,
+                    'p50_ms': latency.quantile(0.5) * 1000,
+                    'p95_ms': latency.quantile(0.95) * 1000,
+                    'avg_ms': latency.sum / n * 1000,
+                    'avg_queries': self._queries[endpoint].sum / n,
+                    'avg_sql_ms': self._sql_time[endpoint].sum / n * 1000,
+                    'avg_template_ms': self._template_time[endpoint].sum / n * 1000,
+                })
+        return sorted(rows, key=lambda row: row['p95_ms'], reverse=True)
+
+    def prometheus(self, prefix='garage'):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            lines += [f'# HELP {prefix}_requests_total Requests handled, by endpoint, method and status.',
+                      f'# TYPE {prefix}_requests_total counter']
+            for (endpoint, method, status), count in sorted(self._requests.items()):
+                lines.append(f'{prefix}_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {count}')
+            for name, store, help_text in (
+                ('request_duration_seconds', self._latency, 'Request latency.'),
+                ('request_queries', self._queries, 'SQL statements per request.'),
+                ('request_sql_seconds', self._sql_time, 'Time spent in SQL per request.'),
+                ('request_template_seconds', self._template_time, 'Time spent rendering templates per request.'),
+            ):
+                lines += [f'# HELP {prefix}_{name} {help_text}', f'# TYPE {prefix}_{name} histogram']
+                for endpoint, histogram in sorted(store.items()):
+                    for bound, total in histogram.cumulative():
+                        le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                        lines.append(f'{prefix}_{name}_bucket{{endpoint="{endpoint}",le="{le}"}} {total}')
+                    lines.append(f'{prefix}_{name}_sum{{endpoint="{endpoint}"}} {histogram.sum:.6f}')
+                    lines.append(f'{prefix}_{name}_count{{endpoint="{endpoint}"}} {histogram.count}')
+            lines += [f'# HELP {prefix}_slow_queries_total Statements slower than the slow query threshold.',
+                      f'# TYPE {prefix}_slow_queries_total counter',
+                      f'{prefix}_slow_queries_total {self._slow_total}']
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,39 @@
+"""Version and updated_at columns on vehicle and service_visit
+
+Revision ID: 0836c0ca485d
+Revises: 96106ef84e08
+Create Date: 2026-10-17 14:12:40.118203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0836c0ca485d'
+down_revision = '96106ef84e08'
+branch_labels = None
+depends_on = None
+
+TABLES = ('vehicle', 'service_visit')
+
+
+def upgrade():
+    # SQLite can only ADD COLUMN with a constant default, and rebuilding the
+    # vehicle table would drop its search triggers, so existing rows get a
+    # placeholder that is replaced right after. New rows get their timestamp
+    # from the model default.
+    sqlite = op.get_bind().dialect.name == 'sqlite'
+    updated_default = sa.text("'1970-01-01 00:00:00'") if sqlite else sa.func.current_timestamp()
+    for table in TABLES:
+        op.add_column(table, sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), server_default=updated_default, nullable=False))
+    op.execute('UPDATE vehicle SET updated_at = CURRENT_TIMESTAMP')
+    op.execute('UPDATE service_visit SET updated_at = date')
+
+
+def downgrade():
+    for table in TABLES:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_column('updated_at')
+            batch_op.drop_column('version')
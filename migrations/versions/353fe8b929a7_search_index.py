@@ -0,0 +1,45 @@
+"""FTS5 search index for vehicles and customers
+
+Revision ID: 353fe8b929a7
+Revises: efdccbbc90a7
+Create Date: 2026-10-17 09:12:40.118372
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '353fe8b929a7'
+down_revision = 'efdccbbc90a7'
+branch_labels = None
+depends_on = None
+
+# Index values per table; {row} is "new." inside triggers and empty when backfilling.
+VEHICLE_VALUES = "{row}plate, lower(replace(replace({row}plate, ' ', ''), '-', '')), {row}name, {row}model"
+CUSTOMER_VALUES = "{row}name, {row}phone, lower(replace(replace({row}phone, ' ', ''), '-', '')), {row}email"
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for table, columns, sources, values in (
+        ('vehicle', 'plate, plate_norm, name, model', 'plate, name, model', VEHICLE_VALUES),
+        ('customer', 'name, phone, phone_norm, email', 'name, phone, email', CUSTOMER_VALUES),
+    ):
+        fts = f'{table}_fts'
+        insert = f'INSERT INTO {fts}(rowid, {columns}) VALUES (new.id, {values.format(row="new.")});'
+        delete = f'DELETE FROM {fts} WHERE rowid = old.id;'
+        op.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({columns}, tokenize='unicode61', prefix='2 3')")
+        op.execute(f'CREATE TRIGGER IF NOT EXISTS {table}_fts_ai AFTER INSERT ON {table} BEGIN {insert} END')
+        op.execute(f'CREATE TRIGGER IF NOT EXISTS {table}_fts_au AFTER UPDATE OF {sources} ON {table} BEGIN {delete} {insert} END')
+        op.execute(f'CREATE TRIGGER IF NOT EXISTS {table}_fts_ad AFTER DELETE ON {table} BEGIN {delete} END')
+        op.execute(f'INSERT INTO {fts}(rowid, {columns}) SELECT id, {values.format(row="")} FROM {table}')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for table in ('customer', 'vehicle'):
+        for suffix in ('ai', 'au', 'ad'):
+            op.execute(f'DROP TRIGGER IF EXISTS {table}_fts_{suffix}')
+        op.execute(f'DROP TABLE IF EXISTS {table}_fts')
@@ -0,0 +1,56 @@
+"""Parts catalogue referenced by service items
+
+Revision ID: 5b2e7c91d0a4
+Revises: 0836c0ca485d
+Create Date: 2026-10-17 14:20:37.512093
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b2e7c91d0a4'
+down_revision = '0836c0ca485d'
+branch_labels = None
+depends_on = None
+
+# Items with the same name and part number (ignoring case and surrounding spaces) share a part
+PART_KEY = "lower(trim(service_item.item_name)) || '|' || lower(trim(coalesce(service_item.part_number, '')))"
+
+
+def upgrade():
+    op.create_table('part',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('lookup_key', sa.String(length=210), nullable=False),
+    sa.Column('name', sa.String(length=100), nullable=False),
+    sa.Column('part_number', sa.String(length=100), nullable=True),
+    sa.Column('usage_count', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('last_price', sa.Float(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('lookup_key')
+    )
+    with op.batch_alter_table('service_item', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('part_id', sa.Integer(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_service_item_part_id'), ['part_id'], unique=False)
+        batch_op.create_foreign_key('fk_service_item_part_id_part', 'part', ['part_id'], ['id'])
+
+    # Dedupe the free-text items into the catalogue, then link every item to its part
+    op.execute(f"""
+        INSERT INTO part (lookup_key, name, part_number, usage_count)
+        SELECT {PART_KEY}, min(item_name), min(part_number), count(*) FROM service_item GROUP BY {PART_KEY}
+    """)
+    op.execute(f"UPDATE service_item SET part_id = (SELECT part.id FROM part WHERE part.lookup_key = {PART_KEY})")
+    op.execute("""
+        UPDATE part SET last_price = (
+            SELECT price FROM service_item WHERE service_item.part_id = part.id ORDER BY id DESC LIMIT 1
+        )
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('service_item', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_service_item_part_id_part', type_='foreignkey')
+        batch_op.drop_index(batch_op.f('ix_service_item_part_id'))
+        batch_op.drop_column('part_id')
+    op.drop_table('part')
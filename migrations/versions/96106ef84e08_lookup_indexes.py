@@ -0,0 +1,33 @@
+"""Foreign-key and lookup indexes
+
+Revision ID: 96106ef84e08
+Revises: a23a148ba4b1
+Create Date: 2026-10-17 10:41:27.380594
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '96106ef84e08'
+down_revision = 'a23a148ba4b1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix_vehicle_customer_id'), 'vehicle', ['customer_id'], unique=False)
+    op.create_index(op.f('ix_vehicle_history_vehicle_id'), 'vehicle_history', ['vehicle_id'], unique=False)
+    op.create_index(op.f('ix_service_visit_date'), 'service_visit', ['date'], unique=False)
+    op.create_index('ix_service_visit_vehicle_id_date', 'service_visit', ['vehicle_id', sa.text('date DESC')], unique=False)
+    op.create_index(op.f('ix_service_item_visit_id'), 'service_item', ['visit_id'], unique=False)
+    op.execute('ANALYZE')
+
+
+def downgrade():
+    op.drop_index(op.f('ix_service_item_visit_id'), table_name='service_item')
+    op.drop_index('ix_service_visit_vehicle_id_date', table_name='service_visit')
+    op.drop_index(op.f('ix_service_visit_date'), table_name='service_visit')
+    op.drop_index(op.f('ix_vehicle_history_vehicle_id'), table_name='vehicle_history')
+    op.drop_index(op.f('ix_vehicle_customer_id'), table_name='vehicle')
@@ -0,0 +1,47 @@
+"""Materialized visit totals in integer cents
+
+Revision ID: a23a148ba4b1
+Revises: 353fe8b929a7
+Create Date: 2026-10-17 10:02:11.504917
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a23a148ba4b1'
+down_revision = '353fe8b929a7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('service_visit', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('parts_total', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('items_labour_total', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('grand_total', sa.Integer(), server_default='0', nullable=False))
+
+    # Backfill in cents: prices are rounded to the cent before multiplying by quantity
+    op.execute("""
+        UPDATE service_visit SET
+            parts_total = COALESCE((
+                SELECT SUM(CAST(ROUND(i.price * 100) AS INTEGER) * i.quantity)
+                FROM service_item i WHERE i.visit_id = service_visit.id
+            ), 0),
+            items_labour_total = COALESCE((
+                SELECT SUM(CAST(ROUND(i.labour * 100) AS INTEGER))
+                FROM service_item i WHERE i.visit_id = service_visit.id
+            ), 0)
+    """)
+    op.execute("""
+        UPDATE service_visit SET
+            grand_total = parts_total + items_labour_total + CAST(ROUND(COALESCE(labour, 0) * 100) AS INTEGER)
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('service_visit', schema=None) as batch_op:
+        batch_op.drop_column('grand_total')
+        batch_op.drop_column('items_labour_total')
+        batch_op.drop_column('parts_total')
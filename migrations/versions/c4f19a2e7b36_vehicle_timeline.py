@@ -0,0 +1,74 @@
+"""Vehicle history as an append-only event log replacing vehicle.history
+
+Revision ID: c4f19a2e7b36
+Revises: 5b2e7c91d0a4
+Create Date: 2026-10-17 15:02:11.204518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4f19a2e7b36'
+down_revision = '5b2e7c91d0a4'
+branch_labels = None
+depends_on = None
+
+
+def day_sql(sqlite, column):
+    """SQL for the YYYY-MM-DD day of a timestamp column."""
+    return f"strftime('%Y-%m-%d', {column})" if sqlite else f"to_char({column}, 'YYYY-MM-DD')"
+
+
+def upgrade():
+    sqlite = op.get_bind().dialect.name == 'sqlite'
+    with op.batch_alter_table('vehicle_history', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('event_type', sa.String(length=20), server_default='note', nullable=False))
+        batch_op.add_column(sa.Column('visit_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('username', sa.String(length=80), nullable=True))
+
+    # The free-text history becomes a note and existing visits become visit
+    # entries, inserted oldest first so the timeline's id order is chronological
+    op.execute(f"""
+        INSERT INTO vehicle_history (vehicle_id, event_type, date, timestamp, description, technician, visit_id)
+        SELECT vehicle_id, event_type, date, timestamp, description, technician, visit_id FROM (
+            SELECT id AS vehicle_id, 'note' AS event_type, {day_sql(sqlite, 'updated_at')} AS date,
+                   updated_at AS timestamp, history AS description, technician, NULL AS visit_id
+            FROM vehicle WHERE trim(coalesce(history, '')) != ''
+            UNION ALL
+            SELECT vehicle_id, 'visit', {day_sql(sqlite, 'date')}, date,
+                   coalesce(visit_category, 'Service') || ' visit' || coalesce(': ' || nullif(notes, ''), ''),
+                   NULL, id
+            FROM service_visit
+        ) AS entries ORDER BY timestamp, visit_id
+    """)
+    if sqlite:
+        # A native DROP COLUMN: rebuilding the vehicle table would drop its search triggers
+        op.execute('ALTER TABLE vehicle DROP COLUMN history')
+        op.execute('ANALYZE vehicle_history')
+    else:
+        op.drop_column('vehicle', 'history')
+
+
+def downgrade():
+    sqlite = op.get_bind().dialect.name == 'sqlite'
+    op.add_column('vehicle', sa.Column('history', sa.Text(), nullable=True))
+    if sqlite:
+        notes = """
+            SELECT group_concat(description, char(10)) FROM (
+                SELECT description FROM vehicle_history
+                WHERE vehicle_history.vehicle_id = vehicle.id AND event_type = 'note' ORDER BY id
+            )
+        """
+    else:
+        notes = """
+            SELECT string_agg(description, chr(10) ORDER BY id) FROM vehicle_history
+            WHERE vehicle_history.vehicle_id = vehicle.id AND event_type = 'note'
+        """
+    op.execute(f'UPDATE vehicle SET history = ({notes})')
+    op.execute("DELETE FROM vehicle_history WHERE event_type != 'note'")
+    with op.batch_alter_table('vehicle_history', schema=None) as batch_op:
+        batch_op.drop_column('username')
+        batch_op.drop_column('visit_id')
+        batch_op.drop_column('event_type')
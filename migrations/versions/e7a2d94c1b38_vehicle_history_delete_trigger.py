@@ -0,0 +1,30 @@
+"""Delete a vehicle's timeline in the database when the vehicle is deleted
+
+Revision ID: e7a2d94c1b38
+Revises: c4f19a2e7b36
+Create Date: 2026-10-17 18:40:52.631904
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7a2d94c1b38'
+down_revision = 'c4f19a2e7b36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Entries left behind by vehicles deleted without the ORM; a vehicle reusing the id would inherit them
+    op.execute('DELETE FROM vehicle_history WHERE vehicle_id NOT IN (SELECT id FROM vehicle)')
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute('CREATE TRIGGER IF NOT EXISTS vehicle_history_ad AFTER DELETE ON vehicle '
+               'BEGIN DELETE FROM vehicle_history WHERE vehicle_id = old.id; END')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute('DROP TRIGGER IF EXISTS vehicle_history_ad')
@@ -0,0 +1,483 @@
+"""PDF vehicle reports and the background queue that renders them.
+
+Rendering only needs plain vehicle/visit objects, so it can run outside the
+request thread. Finished PDFs are written to an on-disk cache keyed by the
+vehicle and its latest visit, so an unchanged report is never drawn twice.
+
+ReportLab is imported on first use, so importing this module (and the web
+app) stays cheap; ReportAssets.warm() pays that cost up front when wanted.
+"""
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import datetime
+from types import SimpleNamespace
+import copy
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+
+FONTS = ('Helvetica', 'Helvetica-Bold', 'Helvetica-Oblique')
+
+
+class ReportAssets:
+    """Process-wide cache of the static assets every report draws.
+
+    The logo is loaded once into an image XObject template (JPEG data is
+    embedded as-is, never decoded) and reloaded only when the file's mtime or
+    size changes. Each canvas registers a shallow copy that shares the data.
+    """
+
+    def __init__(self, logo_path):
+        self.logo_path = logo_path
+        self._logo = None
+        self._logo_stamp = None
+        self._lock = threading.Lock()
+
+    def warm(self):
+        """Load fonts and the logo up front so the first report pays nothing extra."""
+        from reportlab.pdfbase import pdfmetrics
+        for font in FONTS:
+            pdfmetrics.getFont(font)
+        self.logo()
+
+    def logo(self):
+        """The logo's image XObject, or None when the file does not exist."""
+        try:
+            st = os.stat(self.logo_path)
+        except OSError:
+            return None
+        stamp = (st.st_mtime_ns, st.st_size)
+        from reportlab.pdfbase import pdfdoc
+        with self._lock:
+            if self._logo_stamp != stamp:
+                name = 'logo' + hashlib.md5(repr((self.logo_path, stamp)).encode()).hexdigest()
+                self._logo = pdfdoc.PDFImageXObject(name, self.logo_path, mask='auto')
+                self._logo_stamp = stamp
+            return self._logo
+
+    def draw_logo(self, p, x, y, width, height):
+        """Equivalent of p.drawImage(logo, ...) reusing the cached XObject.
+
+        Sharing the XObject needs ReportLab internals; a canvas without them
+        (a ReportLab upgrade) falls back to drawImage, which re-encodes the
+        logo for every document but draws the same thing.
+        """
+        template = self.logo()
+        if template is None:
+            return
+        if not _can_share_xobjects(p):
+            p.drawImage(self.logo_path, x, y, width, height, mask='auto')
+            return
+        doc = p._doc
+        reg_name = doc.getXObjectName(template.name)
+        if reg_name not in doc.idToObject:
+            # A PDF object can belong to one document only
+            logo = copy.copy(template)
+            p._setXObjects(logo)
+            doc.Reference(logo, reg_name)
+            doc.addForm(logo.name, logo)
+        p._currentPageHasImages = 1
+        p.saveState()
+        p.translate(x, y)
+        p.scale(width, height)
+        p.doForm(template.name)
+        p.restoreState()
+
+
+def _can_share_xobjects(p):
+    """Whether canvas `p` has the ReportLab internals ReportAssets.draw_logo() registers its XObject with."""
+    doc = getattr(p, '_doc', None)
+    return (doc is not None and hasattr(p, '_setXObjects') and hasattr(p, '_currentPageHasImages')
+            and all(hasattr(doc, name) for name in ('getXObjectName', 'idToObject', 'Reference', 'addForm')))
+
+
+def render_vehicle_report(out, v, visits, assets):
+    """Draw the comprehensive report of vehicle `v` into `out` (path or file object)."""
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+    p = canvas.Canvas(out, pagesize=letter)
+    draw_vehicle_report(p, v, visits, assets)
+    p.save()
+
+
+def render_fleet_pdf(out, vehicles, assets, progress=None):
+    """Draw the reports of several vehicles into one document, each starting on a new page.
+
+    `vehicles` yields (vehicle, visits) pairs and may be a generator. This
+    runs in the calling thread, unlike render_fleet_zip(): a report draws in
+    a few milliseconds, and merging PDFs rendered in other processes would
+    embed the logo once per vehicle instead of once per document.
+    """
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+    p = canvas.Canvas(out, pagesize=letter)
+    done = 0
+    for v, visits in vehicles:
+        if done:
+            p.showPage()
+        draw_vehicle_report(p, v, visits, assets)
+        done += 1
+        if progress:
+            progress(done)
+    p.save()
+
+
+def draw_vehicle_report(p, v, visits, assets):
+    from reportlab.lib.pagesizes import letter
+    width, height = letter
+    y = height - 40
+
+    # Company logo and details
+    logo_height = 50
+    logo_width = 100
+    logo_y = y - logo_height + 10
+    assets.draw_logo(p, 40, logo_y, logo_width, logo_height)
+    p.setFont('Helvetica-Bold', 18)
+    p.drawString(160, y-20, "POWERTUNE AUTO GARAGE")
+    p.setFont('Helvetica', 10)
+    p.drawString(160, y-38, "Nairobi, Kenya | Tel: 0748 638225 | Email: info@powertune.co.ke")
+    y -= 70
+
+    # Vehicle and customer details
+    p.setFont('Helvetica-Bold', 15)
+    p.drawString(40, y, f"Vehicle Comprehensive Report")
+    y -= 20
+    p.setFont('Helvetica', 12)
+    p.drawString(40, y, f"Vehicle: {v.name} ({v.plate})")
+    y -= 16
+    p.drawString(40, y, f"Model: {v.model}")
+    y -= 16
+    p.drawString(40, y, f"VIN: {v.vin_number or '-'}")
+    y -= 16
+    p.drawString(40, y, f"Visit Category: {v.type or '-'}")
+    y -= 16
+    p.drawString(40, y, f"Status: {v.status}")
+    y -= 16
+    p.drawString(40, y, f"Date Booked: {v.date_booked or '-'}")
+    y -= 16
+    p.drawString(40, y, f"Technician: {v.technician or '-'}")
+    y -= 28
+
+    if v.customer:
+        p.drawString(40, y, "Customer Details:")
+        y -= 14
+        p.setFont('Helvetica', 11)
+        p.drawString(60, y, f"Name: {v.customer.name}")
+        y -= 14
+        p.drawString(60, y, f"Phone: {v.customer.phone}")
+        y -= 14
+        p.drawString(60, y, f"Email: {v.customer.email}")
+        y -= 16
+        p.setFont('Helvetica', 12)
+    y -= 10
+
+    # Service Visits
+    p.setFont('Helvetica-Bold', 13)
+    p.drawString(40, y, "Visit & Service History:")
+    y -= 18
+    p.setFont('Helvetica', 11)
+    # `visits` may be a generator streaming rows from the database; each visit
+    # is drawn and then released, so only one batch is held in memory
+    idx = 0
+    for idx, visit in enumerate(visits, 1):
+        if y < 100:
+            p.showPage()
+            y = height - 40
+        p.setFont('Helvetica-Bold', 11)
+        p.drawString(50, y, f"{idx}. Date: {visit.date.strftime('%Y-%m-%d %H:%M')} | Category: {visit.visit_category or '-'} | Notes: {visit.notes or '-'}")
+        y -= 14
+        p.setFont('Helvetica', 11)
+        items = visit.items
+        if items:
+            p.drawString(70, y, "Items:")
+            y -= 14
+            for item in items:
+                p.drawString(80, y, f"- {item.item_name} | Part#: {item.part_number or '-'} | Qty: {item.quantity} | Price: {item.price} | Labour: {item.labour or 0}")
+                y -= 12
+        p.drawString(80, y, f"Parts Total: {visit.parts_total} | Labour (Items): {visit.items_labour_total} | Labour (Visit): {visit.labour or 0:.2f} | Grand Total: {visit.grand_total}")
+        y -= 18
+    if idx == 0:
+        p.drawString(40, y, "No service visits found.")
+
+    p.setFont('Helvetica-Oblique', 9)
+    p.drawString(40, 30, "Generated by Powertune Garage System - {date}".format(date=datetime.now().strftime('%Y-%m-%d %H:%M')))
+
+
+def snapshot(v, visits):
+    """Picklable copy of a vehicle and its visits, for rendering in another process."""
+    c = v.customer
+    return SimpleNamespace(
+        id=v.id, name=v.name, plate=v.plate, model=v.model, vin_number=v.vin_number, type=v.type,
+        status=v.status, date_booked=v.date_booked, technician=v.technician,
+        customer=c and SimpleNamespace(name=c.name, phone=c.phone, email=c.email),
+        visits=[SimpleNamespace(
+            date=visit.date, visit_category=visit.visit_category, notes=visit.notes, labour=visit.labour,
+            parts_total=visit.parts_total, items_labour_total=visit.items_labour_total, grand_total=visit.grand_total,
+            items=[SimpleNamespace(
+                item_name=item.item_name, part_number=item.part_number, quantity=item.quantity,
+                price=item.price, labour=item.labour
+            ) for item in visit.items]
+        ) for visit in visits]
+    )
+
+
+# Assets of a fleet render worker process, set up by _init_worker
+_worker_assets = None
+
+
+def _init_worker(logo_path):
+    global _worker_assets
+    _worker_assets = ReportAssets(logo_path)
+    _worker_assets.warm()
+
+
+def _render_snapshot(path, vehicle):
+    render_vehicle_report(path, vehicle, vehicle.visits, _worker_assets)
+
+
+def render_fleet_zip(out, entries, processes, logo_path, progress=None):
+    """Write a ZIP of per-vehicle report PDFs, rendering them on a process pool.
+
+    `entries` yields (file name, source) pairs where source is either the
+    path of an already rendered PDF or a snapshot() to render. At most two
+    snapshots per process are in flight, so a long generator of entries never
+    has to be held in memory.
+    """
+    done = 0
+    with tempfile.TemporaryDirectory() as tmp, \
+            zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED) as archive, \
+            ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=(logo_path,)) as pool:
+        pending = {}
+
+        def collect(return_when):
+            nonlocal done
+            finished, _ = wait(pending, return_when=return_when)
+            for future in finished:
+                name, path = pending.pop(future)
+                future.result()
+                archive.write(path, name)
+                os.remove(path)
+                done += 1
+                if progress:
+                    progress(done)
+
+        for n, (name, source) in enumerate(entries):
+            if isinstance(source, str):
+                archive.write(source, name)
+                done += 1
+                if progress:
+                    progress(done)
+                continue
+            path = os.path.join(tmp, f'{n}.pdf')
+            pending[pool.submit(_render_snapshot, path, source)] = (name, path)
+            if len(pending) >= processes * 2:
+                collect(FIRST_COMPLETED)
+        if pending:
+            collect(ALL_COMPLETED)
+
+
+class ReportCache:
+    """Directory of finished report files, one file per cache key.
+
+    Keys are file names such as "vehicle-12-<version>.pdf".
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        path = self.path(key)
+        return path if os.path.exists(path) else None
+
+    def render(self, key, render, *args):
+        """Call render(file_path, *args) and publish the result atomically under `key`.
+
+        Keys look like "<kind>-<id>-<version>"; older versions for the same
+        kind and id are removed once the new file is in place, so variants of
+        one report that should be kept side by side need different kinds.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key)
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        try:
+            render(tmp_path, *args)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self._remove_stale(key)
+        return path
+
+    def purge(self, max_age):
+        """Remove files not modified for `max_age` seconds."""
+        if not os.path.isdir(self.directory):
+            return
+        cutoff = time.time() - max_age
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def _remove_stale(self, key):
+        group = key.split('-', 2)[:2]
+        for name in os.listdir(self.directory):
+            if not name.endswith('.tmp') and name != key and name.split('-', 2)[:2] == group:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+
+class ReportJob:
+    def __init__(self, key, meta=None, job_id=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.key = key
+        self.meta = meta or {}
+        self.status = 'queued'  # queued -> running -> done | failed
+        self.path = None
+        self.error = None
+        self.finished_at = None
+        self.progress = None
+        self.pid = os.getpid()  # process rendering the job
+
+    def to_dict(self):
+        return dict(self.meta, job_id=self.id, status=self.status, error=self.error, progress=self.progress)
+
+    def state(self):
+        return {'id': self.id, 'key': self.key, 'meta': self.meta, 'status': self.status, 'path': self.path,
+                'error': self.error, 'progress': self.progress, 'pid': self.pid}
+
+    @classmethod
+    def from_state(cls, state):
+        job = cls(state['key'], state['meta'], state['id'])
+        job.status, job.path, job.error, job.progress, job.pid = (
+            state[name] for name in ('status', 'path', 'error', 'progress', 'pid'))
+        if job.status in ('queued', 'running') and not _process_alive(job.pid):
+            job.status, job.error = 'failed', 'The worker rendering this report stopped; please try again.'
+        return job
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass  # exists but belongs to another user
+    return True
+
+
+class ReportJobQueue:
+    """Renders reports on a small thread pool, one job per cache key at a time.
+
+    Each web worker process renders its own jobs, but job state is also
+    written to a JSON file next to the cache, so a status poll or download
+    served by another worker of the same host finds the job.
+    """
+
+    # Finished jobs are forgotten after this many seconds
+    JOB_TTL = 3600
+
+    def __init__(self, cache, max_workers=2):
+        self.cache = cache
+        self.max_workers = max_workers
+        self.state_dir = os.path.join(cache.directory, 'jobs')
+        self._executor = None
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, render, meta=None):
+        """Queue render(file_path, set_progress) for `key` unless it is cached or already queued.
+
+        `meta` is returned with the job status, e.g. the vehicle the report is for.
+        """
+        with self._lock:
+            self._prune()
+            for job in self._jobs.values():
+                if job.key == key and job.status in ('queued', 'running'):
+                    return job
+            job = ReportJob(key, meta)
+            self._jobs[job.id] = job
+            cached = self.cache.get(key)
+            if cached:
+                self._finish(job, path=cached)
+                return job
+            self._save(job)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='report')
+            self._executor.submit(self._run, job, render)
+            return job
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return job or self._load(job_id)
+
+    def _run(self, job, render):
+        def set_progress(done):
+            job.progress = done
+            self._save(job)
+
+        job.status = 'running'
+        self._save(job)
+        try:
+            path = self.cache.render(job.key, render, set_progress)
+        except Exception as exc:
+            logger.exception('Report job %s failed', job.key)
+            self._finish(job, error=str(exc))
+        else:
+            self._finish(job, path=path)
+
+    def _finish(self, job, path=None, error=None):
+        job.path = path
+        job.error = error
+        job.status = 'failed' if error else 'done'
+        job.finished_at = time.monotonic()
+        self._save(job)
+
+    def _state_path(self, job_id):
+        return os.path.join(self.state_dir, f'{job_id}.json')
+
+    def _save(self, job):
+        os.makedirs(self.state_dir, exist_ok=True)
+        path = self._state_path(job.id)
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(job.state(), f)
+        os.replace(tmp_path, path)
+
+    def _load(self, job_id):
+        if not job_id.isalnum():  # ids are hex; anything else is not a job file
+            return None
+        try:
+            with open(self._state_path(job_id)) as f:
+                return ReportJob.from_state(json.load(f))
+        except (OSError, ValueError):
+            return None
+
+    def _prune(self):
+        now = time.monotonic()
+        for job_id in [j.id for j in self._jobs.values() if j.finished_at and now - j.finished_at > self.JOB_TTL]:
+            del self._jobs[job_id]
+        if os.path.isdir(self.state_dir):
+            cutoff = time.time() - self.JOB_TTL
+            for name in os.listdir(self.state_dir):
+                try:
+                    if os.path.getmtime(os.path.join(self.state_dir, name)) < cutoff:
+                        os.remove(os.path.join(self.state_dir, name))
+                except OSError:
+                    pass
@@ -0,0 +1,135 @@
+"""SQLite FTS5 search index for vehicles and customers.
+
+Each searchable table gets a `<table>_fts` virtual table keyed by the row id.
+The index is kept in sync by SQL triggers, so rows written through the ORM,
+bulk inserts or raw SQL are all searchable without any application hooks.
+Plates and phone numbers are also indexed in a normalized form (no spaces or
+dashes, lower case) so "KAA 123A", "kaa-123a" and "KAA123A" all match.
+"""
+import re
+
+from sqlalchemy import DDL, event, text
+
+
+# table name -> (fts table, [(fts column, source column, normalized?)])
+INDEXES = {
+    'vehicle': ('vehicle_fts', [
+        ('plate', 'plate', False),
+        ('plate_norm', 'plate', True),
+        ('name', 'name', False),
+        ('model', 'model', False),
+    ]),
+    'customer': ('customer_fts', [
+        ('name', 'name', False),
+        ('phone', 'phone', False),
+        ('phone_norm', 'phone', True),
+        ('email', 'email', False),
+    ]),
+}
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+_available = set()
+
+
+def _values(columns, prefix=''):
+    exprs = []
+    for _, source, normalized in columns:
+        column = prefix + source
+        exprs.append(f"lower(replace(replace({column}, ' ', ''), '-', ''))" if normalized else column)
+    return ', '.join(exprs)
+
+
+def ddl_statements(table):
+    """CREATE statements for the index of `table` and the triggers feeding it."""
+    fts, columns = INDEXES[table]
+    names = ', '.join(name for name, _, _ in columns)
+    new_values = _values(columns, 'new.')
+    insert = f'INSERT INTO {fts}(rowid, {names}) VALUES (new.id, {new_values});'
+    delete = f'DELETE FROM {fts} WHERE rowid = old.id;'
+    sources = ', '.join(dict.fromkeys(source for _, source, _ in columns))
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({names}, tokenize='unicode61', prefix='2 3')",
+        f'CREATE TRIGGER IF NOT EXISTS {table}_fts_ai AFTER INSERT ON {table} BEGIN {insert} END',
+        f'CREATE TRIGGER IF NOT EXISTS {table}_fts_au AFTER UPDATE OF {sources} ON {table} BEGIN {delete} {insert} END',
+        f'CREATE TRIGGER IF NOT EXISTS {table}_fts_ad AFTER DELETE ON {table} BEGIN {delete} END',
+    ]
+
+
+def drop_statements(table):
+    fts = INDEXES[table][0]
+    return [f'DROP TRIGGER IF EXISTS {table}_fts_{suffix}' for suffix in ('ai', 'au', 'ad')] + [
+        f'DROP TABLE IF EXISTS {fts}'
+    ]
+
+
+def rebuild_statements(table):
+    """Statements that repopulate the index of `table` from scratch."""
+    fts, columns = INDEXES[table]
+    names = ', '.join(name for name, _, _ in columns)
+    return [
+        f'DELETE FROM {fts}',
+        f'INSERT INTO {fts}(rowid, {names}) SELECT id, {_values(columns)} FROM {table}',
+    ]
+
+
+def attach(table):
+    """Create the index alongside `table` whenever metadata.create_all() builds it."""
+    for stmt in ddl_statements(table.name):
+        event.listen(table, 'after_create', DDL(stmt).execute_if(dialect='sqlite'))
+    for stmt in drop_statements(table.name):
+        event.listen(table, 'before_drop', DDL(stmt).execute_if(dialect='sqlite'))
+
+
+def normalize(value):
+    return re.sub(r'[\s-]+', '', value or '').lower()
+
+
+def match_expression(table, q):
+    """Build an FTS5 MATCH expression for the user query `q`.
+
+    Every word must match as a prefix in some column; alternatively the whole
+    query, normalized, may prefix-match the normalized plate/phone column.
+    """
+    tokens = _TOKEN_RE.findall(q.lower())
+    if not tokens:
+        return None
+    expr = '(' + ' AND '.join(f'"{token}"*' for token in tokens) + ')'
+    norm = normalize(q).replace('"', '""')
+    if norm:
+        column = next(name for name, _, normalized in INDEXES[table][1] if normalized)
+        expr += f' OR {column}:"{norm}"*'
+    return expr
+
+
+def is_available(session, table):
+    """True when the FTS index for `table` exists in the bound database."""
+    if table in _available:
+        return True
+    bind = session.get_bind()
+    if bind.dialect.name != 'sqlite':
+        return False
+    found = session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {'name': INDEXES[table][0]}
+    ).first()
+    if found:
+        _available.add(table)
+    return found is not None
+
+
+def search_ids(session, table, q, limit, offset=0):
+    """Ids of rows in `table` matching `q`, best match first."""
+    expr = match_expression(table, q)
+    if expr is None:
+        return []
+    fts = INDEXES[table][0]
+    rows = session.execute(
+        text(f'SELECT rowid FROM {fts} WHERE {fts} MATCH :expr ORDER BY rank LIMIT :limit OFFSET :offset'),
+        {'expr': expr, 'limit': limit, 'offset': offset}
+    )
+    return [row[0] for row in rows]
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    """Alembic autogenerate filter: the FTS tables are not part of the model metadata."""
+    return not (type_ == 'table' and any(name.startswith(fts) for fts, _ in INDEXES.values()))
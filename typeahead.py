@@ -0,0 +1,160 @@
+"""In-memory prefix indexes for typeahead lookups (customer and part pickers).
+
+Every row contributes a few search keys (the words of its name and its phone
+number as digits). The keys are kept in one sorted list of (key, row id)
+pairs, so a prefix lookup is a bisect followed by a short scan and never
+touches the database. A query of several words returns the
+rows that have a key starting with each word.
+
+RankedPrefixIndex orders the matches by a usage count instead, so the part
+fitted most often comes first after a single keystroke; the top results of
+one- and two-letter prefixes are memoized until the next change.
+
+The indexes are per process. The app updates it after committed writes and
+picks up rows inserted by other processes by id; a periodic rebuild
+catches edits and deletes made elsewhere.
+"""
+import bisect
+import heapq
+import itertools
+import re
+import threading
+import time
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+_NON_DIGIT_RE = re.compile(r'\D')
+
+
+def normalize(text):
+    return ' '.join(_WORD_RE.findall((text or '').lower()))
+
+
+def phone_keys(phone):
+    digits = _NON_DIGIT_RE.sub('', phone or '')
+    keys = {digits} if digits else set()
+    if digits.startswith('0'):
+        keys.add(digits.lstrip('0'))  # "0712..." is also found as "712..."
+    return keys
+
+
+def customer_keys(name, phone):
+    return {*normalize(name).split(), *phone_keys(phone)}
+
+
+def part_keys(name, part_number):
+    number = ''.join(normalize(part_number).split())  # "90915-YZZD2" -> "90915yzzd2"
+    return {*normalize(name).split(), number} - {''}
+
+
+class PrefixIndex:
+    def __init__(self, keys, max_age=300):
+        self.keys = keys  # keys(*fields) -> set of search keys of a row
+        self.max_age = max_age
+        self.max_id = 0
+        self.built = None
+        self._entries = []  # sorted (key, id)
+        self._row_keys = {}  # id -> keys, for removal
+        self._lock = threading.Lock()
+
+    def is_stale(self):
+        return self.built is None or time.monotonic() - self.built > self.max_age
+
+    def invalidate(self):
+        self.built = None
+
+    def rebuild(self, rows):
+        """Replace the contents with `rows` of (id, *fields)."""
+        row_keys = {row[0]: self.keys(*row[1:]) for row in rows}
+        entries = [(key, row_id) for row_id, keys in row_keys.items() for key in keys]
+        entries.sort()
+        with self._lock:
+            self._entries = entries
+            self._row_keys = row_keys
+            self.max_id = max(row_keys, default=0)
+            self.built = time.monotonic()
+
+    def update(self, row_id, *fields):
+        keys = self.keys(*fields)
+        with self._lock:
+            self._remove(row_id)
+            for key in keys:
+                bisect.insort(self._entries, (key, row_id))
+            self._row_keys[row_id] = keys
+            self.max_id = max(self.max_id, row_id)
+
+    def remove(self, row_id):
+        with self._lock:
+            self._remove(row_id)
+
+    def _remove(self, row_id):
+        for key in self._row_keys.pop(row_id, ()):
+            i = bisect.bisect_left(self._entries, (key, row_id))
+            if i < len(self._entries) and self._entries[i] == (key, row_id):
+                del self._entries[i]
+
+    def _matches(self, query):
+        """Ids with a key starting with each word of `query`, in key order (call with the lock held)."""
+        words = normalize(query).split()
+        if words and all(word.isdigit() for word in words):
+            words = [''.join(words)]  # "0712 345" is one phone number
+        if not words:
+            return
+        first, others = words[0], words[1:]
+        seen = set()
+        i = bisect.bisect_left(self._entries, (first,))
+        while i < len(self._entries) and self._entries[i][0].startswith(first):
+            row_id = self._entries[i][1]
+            if row_id not in seen and all(
+                any(key.startswith(word) for key in self._row_keys[row_id]) for word in others
+            ):
+                seen.add(row_id)
+                yield row_id
+            i += 1
+
+    def search(self, query, limit=10):
+        """Ids of up to `limit` rows matching `query`, in key order."""
+        with self._lock:
+            return list(itertools.islice(self._matches(query), limit))
+
+
+class RankedPrefixIndex(PrefixIndex):
+    """PrefixIndex whose rows carry a usage count; search returns the most used matches first."""
+
+    def __init__(self, keys, max_age=300):
+        super().__init__(keys, max_age)
+        self._usage = {}
+        self._top = {}  # (short query, limit) -> ids
+
+    def rebuild(self, rows):
+        """Replace the contents with `rows` of (id, usage, *fields)."""
+        rows = list(rows)
+        super().rebuild((row[0], *row[2:]) for row in rows)
+        with self._lock:
+            self._usage = {row[0]: row[1] for row in rows}
+            self._top.clear()
+
+    def update(self, row_id, usage, *fields):
+        super().update(row_id, *fields)
+        with self._lock:
+            self._usage[row_id] = usage
+            self._top.clear()
+
+    def add_usage(self, row_id, count, *fields):
+        self.update(row_id, self._usage.get(row_id, 0) + count, *fields)
+
+    def remove(self, row_id):
+        with self._lock:
+            self._remove(row_id)
+            self._usage.pop(row_id, None)
+            self._top.clear()
+
+    def search(self, query, limit=10):
+        """Ids of the `limit` most used rows matching `query`."""
+        memo = (normalize(query), limit) if len(normalize(query)) <= 2 else None
+        with self._lock:
+            if memo in self._top:
+                return self._top[memo]
+            ids = heapq.nsmallest(limit, self._matches(query), key=lambda row_id: -self._usage.get(row_id, 0))
+            if memo:
+                self._top[memo] = ids
+        return ids
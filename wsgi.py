@@ -0,0 +1,33 @@
+"""WSGI entry point for production servers.
+
+First-time setup (and after pulling new migrations):
+
+    flask --app app init-db
+    flask --app app create-admin
+
+Serving with gunicorn (Linux/macOS), settings in gunicorn.conf.py:
+
+    SECRET_KEY=... gunicorn -c gunicorn.conf.py wsgi:app
+
+gunicorn imports this module once in the master (preload_app) and forks the
+workers from it, so they start with the code, templates and report assets
+already loaded. On Windows, waitress serves the same module with threads
+only:
+
+    waitress-serve --listen=127.0.0.1:5001 --threads=8 wsgi:app
+
+Periodic jobs, e.g. nightly from cron:
+
+    flask --app app analytics-snapshot
+    flask --app app archive-visits     # visits older than ARCHIVE_AFTER_DAYS
+
+Every worker keeps its own in-process caches (dashboard statistics, user
+roles, rendered fragments; set FRAGMENT_CACHE=sqlite to share the last one)
+and its own /metrics numbers. Background report jobs render in the worker
+that queued them; their state is written to files in the report cache
+directories, so a status poll or download served by any other worker on the
+same host finds the job.
+"""
+from app import serving_app
+
+app = serving_app()